@@ -40,9 +40,13 @@ def start():
     parser.add_argument('--commandername', default=config.COMMANDER,
                         dest='commandername',
                         help='your username that you use in Minecraft')
+    parser.add_argument('--worldcache', default=config.WORLD_CACHE_DIR,
+                        dest='worldcache',
+                        help='directory to keep the chunks of each server and dimension in')
     args = parser.parse_args()
     config.USERNAME = args.botname
     config.COMMANDER = args.commandername
+    config.WORLD_CACHE_DIR = args.worldcache
     host = args.serverhost
     port = args.serverport
     world = World(host=host, port=port, commander_name=args.commandername, bot_name=args.botname)
@@ -9,7 +9,7 @@ from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, Factory
 from twisted.internet.endpoints import TCP4ServerEndpoint, TCP4ClientEndpoint
 
-from twistedbot.packets import make_packet, parse_packets, packets
+from twistedbot.packets import make_packet, packets, PacketStream
 from twistedbot import encryption
 from twistedbot import logbot
 
@@ -33,13 +33,12 @@ class ProxyProtocol(Protocol):
     def parse_encrypted_stream(self, bytestream):
         plaintext = self.decipher.decrypt(bytestream)
         self.opposite_proxy_side.protocol.sendData(plaintext)
-        data = self.leftover + plaintext
-        parsed_packets, self.leftover = parse_packets(data)
-        processor.process_packets(self.mgsside, parsed_packets,
-                                  encrypted=True, leftover=self.leftover)
+        parsed_packets = self.stream.feed(plaintext)
+        processor.process_packets(self.mgsside, parsed_packets, encrypted=True)
 
     def start_encryption(self):
         self.encryption_on = True
+        self.stream.keep_raw = False
         self.parser = self.parse_encrypted_stream
         self.log.msg("Starting encryption")
 
@@ -50,7 +49,7 @@ class ProxyServerProtocol(ProxyProtocol):
         self.factory = factory
         self.encryption_on = False
         self.parser = self.parse_stream
-        self.leftover = ""
+        self.stream = PacketStream(keep_raw=True)
         self.mgsside = self.factory.mgsside
         self.log = self.factory.log
         self.opposite_proxy_side = self.factory.proxyclient
@@ -64,11 +63,9 @@ class ProxyServerProtocol(ProxyProtocol):
         self.factory.proxyclient.protocol.transport.loseConnection()
 
     def parse_stream(self, bytestream):
-        data = self.leftover + bytestream
-        parsed_packets, self.leftover = parse_packets(data)
-        processor.process_packets(
-            self.mgsside, parsed_packets, leftover=self.leftover)
-        for p in parsed_packets:
+        parsed_packets = self.stream.feed(bytestream)
+        processor.process_packets(self.mgsside, parsed_packets)
+        for p, data in zip(parsed_packets, self.stream.raw):
             if p[0] == 253:
                 self.on_encryption_key_request(p[1])
                 self.factory.proxyclient.protocol.send_encryption_key_request(
@@ -151,7 +148,8 @@ class ProxyClientProtocol(ProxyProtocol):
         self.factory = factory
         self.encryption_on = False
         self.parser = self.parse_stream
-        self.leftover = ""
+        self.postponed = ""
+        self.stream = PacketStream(keep_raw=True)
         self.mgsside = self.factory.mgsside
         self.log = self.factory.log
         self.proxyserver = ProxyServerFactory(self.factory)
@@ -173,13 +171,13 @@ class ProxyClientProtocol(ProxyProtocol):
         if self.proxyserver.protocol is None:
             self.log.msg(
                 "Not having connection to server yet, postpone proxying")
-            self.leftover += bytestream
+            self.postponed += bytestream
             return
-        data = self.leftover + bytestream
-        parsed_packets, self.leftover = parse_packets(data)
-        processor.process_packets(
-            self.mgsside, parsed_packets, leftover=self.leftover)
-        for p in parsed_packets:
+        bytestream = self.postponed + bytestream
+        self.postponed = ""
+        parsed_packets = self.stream.feed(bytestream)
+        processor.process_packets(self.mgsside, parsed_packets)
+        for p, data in zip(parsed_packets, self.stream.raw):
             if p[0] == 252:
                 self.on_encryption_key_responce(p[1])
                 self.proxyserver.protocol.send_encryption_key_response()
@@ -98,6 +98,21 @@ class AABB(object):
                 return False
         return True
 
+    def collides_at(self, bb, dx, dy, dz):
+        """
+        same as collides(bb + (dx, dy, dz)) without making the new box
+        """
+        if fops.lte(self.max_x, bb.min_x + dx) or \
+                fops.gte(self.min_x, bb.max_x + dx):
+            return False
+        if fops.lte(self.max_y, bb.min_y + dy) or \
+                fops.gte(self.min_y, bb.max_y + dy):
+            return False
+        if fops.lte(self.max_z, bb.min_z + dz) or \
+                fops.gte(self.min_z, bb.max_z + dz):
+            return False
+        return True
+
     def collides_on_axes(self, bb, x=False, y=False, z=False):
         if not (x or y or z):
             raise Exception("axes not set in collides_on_axes")
@@ -1,7 +1,6 @@
 ﻿
 import math
 
-from twisted.internet.task import cooperate
 from twisted.internet.defer import inlineCallbacks, returnValue
 
 import config
@@ -10,7 +9,7 @@ import tools
 import logbot
 import fops
 from gridspace import GridSpace
-from pathfinding import AStar
+from pathfinding import AStar, DStarLite, ChunkAStar, Path, chunk_distance
 
 log = logbot.getlogger("BEHAVIOURS")
 
@@ -205,6 +204,9 @@ class TravelToBehaviour(BehaviourBase):
     def __init__(self, *args, **kwargs):
         super(TravelToBehaviour, self).__init__(*args, **kwargs)
         self.travel_coords = kwargs["coords"]
+        self.leg_coords = self.travel_coords
+        self.planner = None
+        self.route_key = None
         self.ready = False
         log.msg(self.name)
 
@@ -218,16 +220,83 @@ class TravelToBehaviour(BehaviourBase):
         if sb is None:
             self.ready = False
         else:
-            d = cooperate(AStar(self.world.navgrid,
-                                sb.coords,
-                                self.travel_coords)).whenDone()
+            route_cache = self.world.navgrid.route_cache
+            fresh = self.planner is None
+            if self.planner is None:
+                if self.route_key is None:
+                    self.world.navgrid.focus(goal=self.travel_coords)
+                    if not self.world.navgrid.reachable(self.travel_coords, start=sb.coords):
+                        if self.world.navgrid.building:
+                            # the navgrid towards the goal is not done yet
+                            return
+                        if self.world.navgrid.unpark():
+                            # the way may detour through parked chunks
+                            return
+                        log.msg("Cannot reach %s from %s" % (str(self.travel_coords), sb.coords))
+                        self.end(Status.failure)
+                        return
+                    self.leg_coords = self.travel_coords
+                    distance = chunk_distance(sb.coords, self.travel_coords)
+                    if distance > config.PATHFIND_CHUNKS:
+                        d = tools.cooperate(ChunkAStar(self.world.navgrid,
+                                                       sb.coords,
+                                                       self.travel_coords,
+                                                       max_computed=config.PATHFIND_COLD_CHUNKS)).whenDone()
+                        d.addErrback(logbot.exit_on_error)
+                        chunk_astar = yield d
+                        if chunk_astar.cold:
+                            # a flat search beats computing the chunk costs, they are computed after it
+                            d = tools.cooperate(AStar(self.world.navgrid,
+                                                      sb.coords,
+                                                      self.travel_coords,
+                                                      max_cost=config.PATHFIND_LIMIT * distance)).whenDone()
+                            d.addErrback(logbot.exit_on_error)
+                            astar = yield d
+                            d = tools.cooperate(ChunkAStar(self.world.navgrid,
+                                                           sb.coords,
+                                                           self.travel_coords)).whenDone()
+                            d.addErrback(logbot.exit_on_error)
+                            if astar.path is not None:
+                                leg = astar.path.leg()
+                                self.leg_coords = leg.nodes[0]
+                                route_cache.put(sb.coords, self.leg_coords, leg.nodes)
+                        if chunk_astar.path is not None:
+                            self.leg_coords = chunk_astar.leg_goal()
+                        elif self.leg_coords == self.travel_coords:
+                            if not self.world.navgrid.unpark() and not self.world.navgrid.building:
+                                self.end(Status.failure)
+                            return
+                    route = route_cache.get(sb.coords, self.leg_coords)
+                    if route is not None:
+                        if self.world.navgrid.check_path(Path(route)):
+                            self.route_key = (sb.coords, self.leg_coords)
+                            self.path = Path(route).smooth(self.world.grid)
+                            self.ready = True
+                            return
+                        route_cache.discard((sb.coords, self.leg_coords))
+                else:
+                    # the cached route did not work out, plan the leg
+                    route_cache.discard(self.route_key)
+                    self.route_key = None
+                self.planner = DStarLite(self.world.navgrid,
+                                         sb.coords,
+                                         self.leg_coords)
+            else:
+                self.planner.move_start(sb.coords)
+            d = tools.cooperate(self.planner).whenDone()
             d.addErrback(logbot.exit_on_error)
-            astar = yield d
-            if astar.path is None:
-                self.status = Status.failure
+            planner = yield d
+            if planner.path is None:
+                if self.world.navgrid.unpark() or self.world.navgrid.building:
+                    # plan again when the parked work is done
+                    self.planner = None
+                else:
+                    self.end(Status.failure)
             else:
-                if self.world.navgrid.check_path(astar.path):
-                    self.path = astar.path
+                if self.world.navgrid.check_path(planner.path):
+                    if fresh:
+                        route_cache.put(sb.coords, self.leg_coords, planner.path.nodes)
+                    self.path = planner.path.smooth(self.world.grid)
                     self.ready = True
 
     def from_child(self, g):
@@ -244,19 +313,36 @@ class TravelToBehaviour(BehaviourBase):
             if not self.ready:
                 return
         if self.path.has_next():
-            gs = GridSpace(self.world.grid, coords=self.path.next_step().coords)
-            if gs.can_stand_on:
-                self.add_subbehaviour(MoveToBehaviour, target_space=gs)
+            gs = GridSpace(self.world.grid, coords=self.path.next_step())
+            passing = self.path.passing()
+            if gs.can_stand_on and all(GridSpace(self.world.grid, coords=crd).can_stand_on for crd in passing):
+                self.add_subbehaviour(MoveToBehaviour, target_space=gs, straight=bool(passing))
             else:
                 self.ready = False
+        elif self.leg_coords != self.travel_coords:
+            self.planner = None
+            self.route_key = None
+            self.ready = False
         else:
-            self.status = Status.success
+            self.end(Status.success)
+
+    def end(self, status):
+        """
+        the travel is over, the navgrid stops leaning towards its goal
+        """
+        self.world.navgrid.clear_goal()
+        self.status = status
+
+    def cancel(self):
+        self.world.navgrid.clear_goal()
+        super(TravelToBehaviour, self).cancel()
 
 
 class MoveToBehaviour(BehaviourBase):
     def __init__(self, *args, **kwargs):
         super(MoveToBehaviour, self).__init__(*args, **kwargs)
         self.target_space = kwargs["target_space"]
+        self.straight = kwargs.get("straight", False)
         self.was_at_target = False
         self.floating_flag = False
         self.name = 'Move to %s' % str(self.target_space.block)
@@ -266,7 +352,7 @@ class MoveToBehaviour(BehaviourBase):
         bb_stand = self.target_space.bb_stand
         elev = bb_stand.min_y - b_obj.aabb.min_y
         gs = GridSpace(self.world.grid, bb=b_obj.aabb)
-        if not self.target_space._can_stand_on():
+        if not self.target_space.compute():
             self.world.grid.navgrid.delete_node(self.target_space.coords)
             log.msg('CANNOT STAND ON %s' % self.target_space)
             return Status.failure
@@ -292,6 +378,11 @@ class MoveToBehaviour(BehaviourBase):
         self.status = self.check_status(b_obj)
         if self.status != Status.running:
             return
+        if self.straight and self.bot.is_standing(b_obj) and \
+                not (self.bot.is_on_ladder(b_obj) or self.bot.is_in_water(b_obj)):
+            # merged flat run, smoothing swept it for collisions already
+            self.move(b_obj)
+            return
         col_distance, col_bb = self.world.grid.min_collision_between(b_obj.aabb,
                                                                      self.target_space.bb_stand,
                                                                      horizontal=True,
@@ -29,6 +29,18 @@ class Block(object):
         self.z = z
         self.meta = meta
 
+    @classmethod
+    def flyweight(cls, meta):
+        """
+        shared instance without grid and coordinates, good only for
+        the properties that depend on block type and meta
+        """
+        blk = cls.__new__(cls)
+        blk.grid = None
+        blk.x = blk.y = blk.z = None
+        blk.meta = meta
+        return blk
+
     def __eq__(self, o):
         return self.x == o.x and self.y == o.y and self.z == o.z and self.meta == o.meta
 
@@ -188,11 +200,11 @@ class BlockWater(BlockFluid):
         v = [0, 0, 0]
         this_efd = self.effective_flow_decay
         for i, j in tools.cross:
-            blk = self.grid.get_block(self.x + i, self.y, self.z + j)
+            blk = self.grid.get_block_type(self.x + i, self.y, self.z + j)
             efd = blk.effective_flow_decay
             if efd < 0:
                 if not blk.material.blocks_movement:
-                    blk = self.grid.get_block(self.x + i, self.y - 1, self.z + j)
+                    blk = self.grid.get_block_type(self.x + i, self.y - 1, self.z + j)
                     efd = blk.effective_flow_decay
                     if efd >= 0:
                         va = efd - (this_efd - 8)
@@ -202,37 +214,37 @@ class BlockWater(BlockFluid):
                 v = [i * va, 0, j * va]
         if self.meta >= 8:
             t = False
-            if t or self.is_solid_block(self.grid.get_block(self.x,
-                                                            self.y,
-                                                            self.z - 1), 2):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x,
+                                                                 self.y,
+                                                                 self.z - 1), 2):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x,
-                                                            self.y,
-                                                            self.z + 1), 3):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x,
+                                                                 self.y,
+                                                                 self.z + 1), 3):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x - 1,
-                                                            self.y,
-                                                            self.z), 4):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x - 1,
+                                                                 self.y,
+                                                                 self.z), 4):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x + 1,
-                                                            self.y,
-                                                            self.z), 5):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x + 1,
+                                                                 self.y,
+                                                                 self.z), 5):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x,
-                                                            self.y + 1,
-                                                            self.z - 1), 2):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x,
+                                                                 self.y + 1,
+                                                                 self.z - 1), 2):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x,
-                                                            self.y + 1,
-                                                            self.z + 1), 3):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x,
+                                                                 self.y + 1,
+                                                                 self.z + 1), 3):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x - 1,
-                                                            self.y + 1,
-                                                            self.z), 4):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x - 1,
+                                                                 self.y + 1,
+                                                                 self.z), 4):
                 t = True
-            if t or self.is_solid_block(self.grid.get_block(self.x + 1,
-                                                            self.y + 1,
-                                                            self.z), 5):
+            if t or self.is_solid_block(self.grid.get_block_type(self.x + 1,
+                                                                 self.y + 1,
+                                                                 self.z), 5):
                 t = True
             if t:
                 v = tools.normalize(v)
@@ -1755,3 +1767,69 @@ clsmembers = inspect.getmembers(sys.modules[__name__], inspect.isclass)
 for _, cl in clsmembers:
     if issubclass(cl, Block) and hasattr(cl, 'number'):
         block_map[cl.number] = cl
+
+COLLIDABLE = 1
+WATER = 2
+LIQUID = 4
+FENCE = 8
+LADDER_VINE = 16
+SIGN = 32
+AVOID = 64
+LOCAL_BOX = 128
+
+
+def _block_flags(blk):
+    flags = 0
+    if blk.collidable:
+        flags |= COLLIDABLE
+    if blk.is_water:
+        flags |= WATER
+    if blk.material.is_liquid:
+        flags |= LIQUID
+    if blk.is_fence:
+        flags |= FENCE
+    if blk.is_ladder_vine:
+        flags |= LADDER_VINE
+    if blk.is_sign:
+        flags |= SIGN
+    if isinstance(blk, (Cobweb, Fire, BlockLava)):
+        flags |= AVOID
+    return flags
+
+
+def _local_bounding_box(blk):
+    """
+    bounding box relative to the block coords, None when it depends on
+    the neighbours or there is more than one box
+    """
+    if not blk.collidable or isinstance(blk, (BlockMultiBox, BlockFence)):
+        return None
+    probe = blk.flyweight(blk.meta)
+    probe.x = probe.y = probe.z = 0
+    try:
+        box = probe.grid_bounding_box
+    except Exception:
+        # meta not used by the game, leave it to the block instance
+        return None
+    if isinstance(box, AABB):
+        return box
+    return None
+
+
+# flat tables indexed by (block_id << 4) | meta, see Grid.get_block_index
+block_types = [None for _ in xrange(4096)]
+block_flags = [0 for _ in xrange(4096)]
+block_local_bb = [None for _ in xrange(4096)]
+block_slipperiness = [Block.slipperiness for _ in xrange(256)]
+for cl in block_map:
+    if cl is None:
+        continue
+    block_slipperiness[cl.number] = cl.slipperiness
+    for meta in xrange(16):
+        index = (cl.number << 4) | meta
+        blk = cl.flyweight(meta)
+        block_types[index] = blk
+        block_flags[index] = _block_flags(blk)
+        block_local_bb[index] = _local_bounding_box(blk)
+        if block_local_bb[index] is not None:
+            block_flags[index] |= LOCAL_BOX
@@ -111,6 +111,7 @@ class BotEntity(object):
         self.check_location_received = True
         if self.location_received is False:
             self.location_received = True
+            self.world.grid.serve_cached((self.bot_object.grid_x >> 4, self.bot_object.grid_z >> 4))
         if not self.in_complete_chunks(self.bot_object):
             log.msg("Server send location into incomplete chunks")
             self.ready = False
@@ -217,7 +218,7 @@ class BotEntity(object):
         return is_in_water
 
     def handle_lava_movement(self, b_obj):
-        for blk in self.world.grid.blocks_in_aabb(
+        for blk in self.world.grid.block_types_in_aabb(
                 b_obj.aabb.expand(-0.10000000149011612,
                             -0.4000000059604645,
                             -0.10000000149011612)):
@@ -301,11 +302,12 @@ class BotEntity(object):
                     b_obj.velocities[1] += config.SPEED_LIQUID_JUMP
                 else:
                     x, y, z = b_obj.aabb.grid_bottom_center
-                    b_up = self.world.grid.get_block(x, y + 1, z)
-                    b_down = self.world.grid.get_block(x, y - 1, z)
-                    b_cent = self.world.grid.get_block(x, y, z)
-                    no_up = not b_up.is_water and b_down.collidable and fops.eq(b_down.max_y, y)
-                    if (not no_up and b_cent.is_water and fops.gt(b_cent.y + 0.5, b_obj.aabb.min_y)) or isinstance(b_up, blocks.StillWater):
+                    b_up = self.world.grid.get_block_type(x, y + 1, z)
+                    b_down = self.world.grid.get_block_type(x, y - 1, z)
+                    b_cent = self.world.grid.get_block_type(x, y, z)
+                    no_up = not b_up.is_water and b_down.collidable and \
+                        fops.eq(self.world.grid.get_block(x, y - 1, z).max_y, y)
+                    if (not no_up and b_cent.is_water and fops.gt(y + 0.5, b_obj.aabb.min_y)) or isinstance(b_up, blocks.StillWater):
                         b_obj.velocities[1] += config.SPEED_LIQUID_JUMP
             orig_y = b_obj.y
             self.update_directional_speed(b_obj, 0.02, balance=True)
@@ -370,10 +372,9 @@ class BotEntity(object):
         slowdown = 0.91
         if b_obj.on_ground:
             slowdown = 0.546
-            block = self.world.grid.get_block(
+            index = self.world.grid.get_block_index(
                 b_obj.grid_x, b_obj.grid_y - 1, b_obj.grid_z)
-            if block is not None:
-                slowdown = block.slipperiness * 0.91
+            slowdown = blocks.block_slipperiness[index >> 4] * 0.91
         return slowdown
 
     def current_speed_factor(self, b_obj):
@@ -410,7 +411,7 @@ class BotEntity(object):
 
     def is_in_web(self, b_obj):
         bb = b_obj.aabb.expand(dx=-0.001, dy=-0.001, dz=-0.001)
-        for blk in self.world.grid.blocks_in_aabb(bb):
+        for blk in self.world.grid.block_types_in_aabb(bb):
             if isinstance(blk, blocks.Cobweb):
                 return True
         return False
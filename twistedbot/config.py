@@ -44,6 +44,8 @@ SPEED_LIQUID_JUMP = 0.03999999910593033
 SPEED_CLIMB = 0.2
 
 TIME_STEP = 0.05
+WORK_SLICE = 0.01  # seconds of pathfinding and navgrid work per reactor turn
+WORK_TICK_RESERVE = 0.001  # work is not started this close before the physics tick
 
 COST_JUMP = 1.1
 COST_LADDER = 0.21 / \
@@ -52,4 +54,22 @@ COST_FALL = 1.1
 COST_DIRECT = 1
 COST_DIAGONAL = math.sqrt(2) * COST_DIRECT
 PATHFIND_LIMIT = 100  # roughly in blocks
+PATHFIND_CHUNKS = 2  # goals farther in chunks are planned over chunk entrances, refined this many chunks ahead
+PATHFIND_COLD_CHUNKS = 4  # chunk planning that has to compute costs in more chunks is left to a flat search meanwhile
 HORIZONTAL_MOVE_DISTANCE_LIMIT = 2.83
+CAN_STAND_MEMORY = 65536  # cached column signatures
+CAN_GO_MEMORY = 65536  # cached edge signatures
+LANDMARKS = 8  # waypoint signs used as ALT heuristic landmarks, 0 to use only the octile distance
+LANDMARKS_ACTIVE = 3  # landmarks with the best bound used in one search
+LANDMARK_REFRESH = 30  # seconds after a navgrid change the landmark distances are computed again
+PATH_SEGMENT = 16  # longest straight flat run of path nodes walked as one move
+NAVGRID_WORKERS = 0  # processes seeding navgrid chunks off the reactor, 0 seeds on the reactor
+NAVGRID_APPLY_BATCH = 64  # seeded nodes added to the navgrid in one work step
+NAVGRID_HORIZON = 8  # chunks from the way between the bot and its travel goal the navgrid is built, farther work waits
+ROUTE_CACHE = 256  # planned paths kept for going the same way again
+AREA_CHECK_LIMIT = 256  # nodes searched to see that a removal did not split an area
+AREA_SEARCH_LIMIT = 4096  # nodes searched in a dirty area before assuming it connected
+CHUNK_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes for chunks and navgrid, farthest chunks are evicted above
+CHUNK_KEEP_DISTANCE = 12  # chunks around the bot that are never evicted
+WORLD_CACHE_DIR = None  # directory of the chunk caches kept per server and dimension, None keeps none
+WORLD_CACHE_RADIUS = 10  # chunks around the spawn and the bot put in the grid from the world cache
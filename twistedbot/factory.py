@@ -9,7 +9,7 @@ import config
 import logbot
 import proxy_processors.default
 import tools
-from packets import parse_packets, make_packet, packets_by_name, Container
+from packets import PacketStream, make_packet, packets_by_name, Container
 from proxy_processors.default import process_packets as packet_printout
 
 
@@ -23,7 +23,6 @@ class MineCraftProtocol(Protocol):
     def __init__(self, world):
         self.world = world
         self.world.protocol = self
-        self.leftover = ""
         self.encryption_on = False
         self.packets = deque()
 
@@ -79,6 +78,13 @@ class MineCraftProtocol(Protocol):
             253: self.p_encryption_key_request,
             255: self.p_error,
         }
+        # handlers of these are no-op, their packets are skipped undecoded
+        self.ignored_packets = [5, 17, 18, 22, 54, 55, 61, 62, 70, 71,
+                                103, 104, 132, 202, 203]
+        if config.DEBUG:
+            self.stream = PacketStream()
+        else:
+            self.stream = PacketStream(skip=self.ignored_packets, lazy=True)
 
     def connectionMade(self):
         self.world.connection_made()
@@ -90,8 +96,18 @@ class MineCraftProtocol(Protocol):
 
     def connectionLost(self, reason):
         self.packets = deque()
+        self.log_stream_stats()
         self.world.on_connection_lost()
 
+    def log_stream_stats(self):
+        decoded = 0
+        skipped = 0
+        for pid, (d, s) in sorted(self.stream.stats().iteritems()):
+            log.msg("packet %d bytes decoded %d skipped %d" % (pid, d, s))
+            decoded += d
+            skipped += s
+        log.msg("TOTAL bytes decoded %d skipped %d" % (decoded, skipped))
+
     def sendData(self, bytestream):
         if self.encryption_on:
             bytestream = self.cipher.encrypt(bytestream)
@@ -106,11 +122,12 @@ class MineCraftProtocol(Protocol):
     def parse_stream(self, bytestream):
         if self.encryption_on:
             bytestream = self.decipher.decrypt(bytestream)
-        parsed_packets, self.leftover = parse_packets(
-            self.leftover + bytestream)
+        skipped = self.stream.packets_skipped
+        parsed_packets = self.stream.feed(bytestream)
+        self.world.status_diff.packets_in += self.stream.packets_skipped - skipped
         if config.DEBUG:
             packet_printout(
-                "SERVER", parsed_packets, self.encryption_on, self.leftover)
+                "SERVER", parsed_packets, self.encryption_on, self.stream.leftover)
         self.packets.extend(parsed_packets)
         self.packet_iter(self.packets)
 
@@ -163,6 +180,7 @@ class MineCraftProtocol(Protocol):
         log.msg("SPAWN POSITION %s" % str(spawn))
         self.world.spawn_position = spawn
         self.world.bot.spawn_point_received = True
+        self.world.grid.serve_cached((c.x >> 4, c.z >> 4))
 
     def p_health(self, c):
         self.world.bot.health_update(c.hp, c.fp, c.saturation)
@@ -1,7 +1,6 @@
 ﻿
-import StringIO
-import array
-
+import sys
+import hashlib
 
 import tools
 import blocks
@@ -9,13 +8,32 @@ import config
 import logbot
 import fops
 from axisbox import AABB
+from gridspace import CanStandMemory, CanGoMemory
+from navsnapshot import NavigationSnapshot, snapshot_path
 
 
 log = logbot.getlogger("GRID")
 
 
+nibble_low = "".join(chr(i & 15) for i in xrange(256))
+nibble_high = "".join(chr(i >> 4) for i in xrange(256))
+# blocks.block_flags of any meta of a block id
+id_flags = [reduce(lambda a, b: a | b, blocks.block_flags[number << 4:(number + 1) << 4]) for number in xrange(256)]
+
+
+def expand_nibbles(data):
+    """
+    half byte array to byte array, low nibble first
+    """
+    out = bytearray(len(data) * 2)
+    out[0::2] = data.translate(nibble_low)
+    out[1::2] = data.translate(nibble_high)
+    return out
+
+
 class Chunk(object):
     levels = config.WORLD_HEIGHT / 16
+    level_size = 2 * sys.getsizeof(bytearray(4096))
 
     def __init__(self, coords):
         self.coords = coords
@@ -30,10 +48,54 @@ class Chunk(object):
         self.biome = [None for _ in xrange(
             config.CHUNK_SIDE_LEN * config.CHUNK_SIDE_LEN)]
         self.complete = False
+        # per 16x16x16 section, id of all its blocks or -1 and flags it may have
+        self.section_ids = [0 for _ in xrange(self.levels)]
+        self.section_flags = [0 for _ in xrange(self.levels)]
 
     def fill_level(self, level):
-        self.blocks[level] = array.array('b', [0 for _ in xrange(4096)])
-        self.meta[level] = array.array('b', [0 for _ in xrange(4096)])
+        self.blocks[level] = bytearray(4096)
+        self.meta[level] = bytearray(4096)
+        self.section_ids[level] = 0
+        self.section_flags[level] = 0
+
+    def summarize(self, level):
+        """
+        compute the section summary of level after its blocks were loaded
+        """
+        ids = self.blocks[level]
+        if ids is None:
+            self.section_ids[level] = 0
+            self.section_flags[level] = 0
+            return
+        present = set(ids)
+        self.section_ids[level] = ids[0] if len(present) == 1 else -1
+        flags = 0
+        for number in present:
+            flags |= id_flags[number]
+        self.section_flags[level] = flags
+
+    def section_changed(self, level, block_id):
+        """
+        block_id was put in the section, flags stay a superset until the
+        next summarize
+        """
+        if self.section_ids[level] != block_id:
+            self.section_ids[level] = -1
+        self.section_flags[level] |= id_flags[block_id]
+
+    def digest(self):
+        """
+        md5 of the block ids and meta of all levels
+        """
+        md5 = hashlib.md5()
+        for level in xrange(self.levels):
+            if self.blocks[level] is None:
+                md5.update("\0")
+            else:
+                md5.update("\1")
+                md5.update(self.blocks[level])
+                md5.update(self.meta[level])
+        return md5.digest()
 
     def __str__(self):
         return "%s %s %s" % (str(self.coords), self.complete, [i if i is None else 1 for i in self.blocks])
@@ -45,7 +107,10 @@ class Grid(object):
         self.chunks = {}
         self.chunks_loaded = 0
         self.spawn_position = None
-        self.can_stand_memory = tools.TreeMemory()
+        self.can_stand_memory = CanStandMemory()
+        self.can_go_memory = CanGoMemory()
+        self.chunks_evicted = 0
+        self.cache = None
 
     def in_spawn_area(self, coords):
         return abs(coords[0] - self.spawn_position[0]) <= 16 or abs(coords[2] - self.spawn_position[2]) <= 16
@@ -60,151 +125,267 @@ class Grid(object):
         else:
             return None
 
-    def get_block(self, x, y, z):
+    def get_block_index(self, x, y, z):
+        """
+        (block id << 4) | meta at x, y, z, air if not loaded.
+        index to the tables in blocks module
+        """
         if y > 255 or y < 0:
-            #return None
-            return blocks.Air(self, x, y, z)
-        chunk_x = x >> 4
-        chunk_z = z >> 4
-        chunk = self.get_chunk((chunk_x, chunk_z))
+            return 0
+        chunk = self.chunks.get((x >> 4, z >> 4), None)
         if chunk is None:
-            return blocks.Air(self, x, y, z)
+            return 0
         y_level = y >> 4
         block_types = chunk.blocks[y_level]
         if block_types is None:
-            #log.err("level %s not in chunk %s" % (y_level, str(chunk.coords)))
-            return blocks.Air(self, x, y, z)
-        cx = x & 15
-        cy = y & 15
-        cz = z & 15
-        pos = self.chunk_array_position(cx, cy, cz)
-        try:
-            return blocks.block_map[block_types[pos]](self, x, y, z, chunk.meta[y_level][pos])
-        except:
-            log.err("get block pos %s y_level %s block_types array length %d meta array length %d " % (pos, y_level, len(block_types), len(chunk.meta[y_level])))
-            raise
+            return 0
+        pos = ((y & 15) << 8) | ((z & 15) << 4) | (x & 15)
+        return (block_types[pos] << 4) | chunk.meta[y_level][pos]
+
+    def get_block_id_meta(self, x, y, z):
+        """
+        (block id, meta) at x, y, z, air if not loaded
+        """
+        index = self.get_block_index(x, y, z)
+        return index >> 4, index & 15
+
+    def get_block_type(self, x, y, z):
+        """
+        shared block instance without coordinates, for the properties that
+        depend only on (block id, meta). use get_block for geometry
+        """
+        return blocks.block_types[self.get_block_index(x, y, z)]
+
+    def get_block(self, x, y, z):
+        block_id, meta = self.get_block_id_meta(x, y, z)
+        return blocks.block_map[block_id](self, x, y, z, meta)
 
     def chunk_updated(self, chunk_x, chunk_z):
+        self.world.navgrid.seed_changed((chunk_x, chunk_z))
+        if self.chunk_complete_at((chunk_x, chunk_z)):
+            self.world.navgrid.seed_chunk((chunk_x, chunk_z))
         for i, j in tools.adjacency:
             c = (chunk_x + i, chunk_z + j)
             if c in self.chunks:
                 self.world.navgrid.incomplete_on_chunk_border(c, (chunk_x, chunk_z))
 
-    def half_bytes_from_string(self, bstr):
-        for s in bstr:
-            bv = ord(s)
-            yield bv & 15
-            yield bv >> 4
-
-    def load_chunk(self, x, z, continuous, primary_bit, add_bit, data_array, update_after=True):
+    def load_chunk(self, x, z, continuous, primary_bit, add_bit, data_array, update_after=True, offset=0, updated=None):
+        """
+        data_array is decompressed chunk data, this chunk starts at offset.
+        returns offset where this chunk data ends. a chunk that was known
+        already, from before a reconnect or from the world cache, is not
+        updated when the data is the same. without update_after changed
+        chunk coords are appended to updated
+        """
         if primary_bit == 0:
             #log.msg("Received chunk erase packet for %s, %s" % (x, z))
             if (x, z) in self.chunks:
                 del self.chunks[(x, z)]
-            return
+                self.can_stand_memory.chunk_change(x, z)
+                self.world.navgrid.route_cache.chunk_change(x, z)
+            if continuous:
+                offset += 256
+            return offset
         self.chunks_loaded += 1
         if (x, z) not in self.chunks:
             chunk = Chunk((x, z))
             self.chunks[(x, z)] = chunk
+            known = None
         else:
             chunk = self.get_chunk((x, z))
+            known = (chunk.blocks[:], chunk.meta[:]) if chunk.complete else None
         if continuous:
             chunk.complete = True
         else:
             log.msg("WARNING: received noncontinuous chunk, current complete state is %s" % chunk.complete)
-        data = StringIO.StringIO(data_array)
-        data_count = 0
-        for i in xrange(chunk.levels):
-            if primary_bit & 1 << i:
-                data_str = data.read(4096)
-                data_count += 4096
-                ndata = array.array('B', data_str)  # y, z, x
-                chunk.blocks[i] = ndata
-        for h in xrange(3):
+        levels = [i for i in xrange(chunk.levels) if primary_bit & 1 << i]
+        sections = {}
+        for i in levels:
+            chunk.blocks[i] = bytearray(buffer(data_array, offset, 4096))  # y, z, x
+            chunk.summarize(i)
+            sections[i] = (offset, None)
+            offset += 4096
+        for i in levels:
+            chunk.meta[i] = expand_nibbles(data_array[offset:offset + 2048])
+            sections[i] = (sections[i][0], offset)
+            offset += 2048
+        if continuous:
+            # levels the server does not send are air
             for i in xrange(chunk.levels):
-                if primary_bit & 1 << i:
-                    data_str = data.read(2048)
-                    data_count += 2048
-                    ndata = array.array(
-                        'B', self.half_bytes_from_string(data_str))
-                    if h == 0:
-                        chunk.meta[i] = ndata
-                    # for now ignore block light and sky light
-                    #elif h == 1:
-                    #    chunk.block_light[i] = ndata
-                    #else:
-                    #    chumk.sky_light[i] = ndata
+                if i not in sections and chunk.blocks[i] is not None:
+                    chunk.blocks[i] = None
+                    chunk.meta[i] = None
+                    chunk.summarize(i)
+        # for now ignore block light and sky light
+        offset += 2 * 2048 * len(levels)
         # higher block id value will be used after Mojang adds them
         for i in xrange(chunk.levels):
             if add_bit >> i & 1:
-                data_str = data.read(2048)
-                data_count += 2048
-                ndata = array.array('B', self.half_bytes_from_string(data_str))
-                log.msg("Add data %s" % ndata)
+                log.msg("Add data %s" % expand_nibbles(data_array[offset:offset + 2048]))
+                offset += 2048
         if continuous:
-            data_str = data.read(256)
-            data_count += 256
-        chunk.biome = array.array('b', data_str)
+            chunk.biome = bytearray(buffer(data_array, offset, 256))
+            offset += 256
+        if known is not None and known == (chunk.blocks, chunk.meta):
+            return offset
+        if continuous and self.cache is not None:
+            self.cache.store((x, z), dict((i, (data_array[ids:ids + 4096], data_array[meta:meta + 2048]))
+                                          for i, (ids, meta) in sections.iteritems()))
+        self.can_stand_memory.chunk_change(x, z)
+        self.world.navgrid.route_cache.chunk_change(x, z, levels if known is None else None)
+        if known is not None:
+            # nodes of the blocks known before
+            self.world.navgrid.evict_chunks(set([(x, z)]))
         if update_after:
             self.chunk_updated(x, z)
+        elif updated is not None:
+            updated.append((x, z))
+        return offset
+
+    def serve_cached(self, center):
+        """
+        put the chunks in the world cache around center chunk into the grid
+        before the server sends them, load_chunk checks them later. the
+        navgrid of chunks that did not change since the snapshot of it is
+        restored, the others are seeded
+        """
+        if self.cache is None:
+            return
+        served = [coords for coords in self.cache.chunks_around(center, config.WORLD_CACHE_RADIUS)
+                  if coords not in self.chunks]
+        for coords in served:
+            chunk = Chunk(coords)
+            self.cache.load(coords, chunk)
+            for level in xrange(chunk.levels):
+                chunk.summarize(level)
+            chunk.complete = True
+            self.chunks[coords] = chunk
+            self.can_stand_memory.chunk_change(coords[0], coords[1])
+            self.world.navgrid.route_cache.chunk_change(coords[0], coords[1])
+        restored = set()
+        snapshot = NavigationSnapshot.open(snapshot_path(self.cache.path)) if served else None
+        if snapshot is not None:
+            restored = snapshot.restore(self.world.navgrid, served)
+            snapshot.close()
+        for coords in served:
+            if coords not in restored:
+                self.chunk_updated(coords[0], coords[1])
+        if served:
+            log.msg("served %d chunks around %s from the %s, navgrid of %d restored" %
+                    (len(served), str(center), self.cache, len(restored)))
+
+    @property
+    def memory_size(self):
+        """
+        approximate bytes used by block and meta arrays
+        """
+        levels = 0
+        for chunk in self.chunks.itervalues():
+            levels += chunk.levels - chunk.blocks.count(None)
+        return levels * Chunk.level_size
+
+    def evict_chunks(self, center):
+        """
+        while chunks and navgrid are over config.CHUNK_MEMORY_BUDGET, unload
+        the chunks farthest from the center chunk, keeping those within
+        config.CHUNK_KEEP_DISTANCE
+        """
+        navgrid = self.world.navgrid
+        size = self.memory_size + navgrid.memory_size
+        if size <= config.CHUNK_MEMORY_BUDGET or not self.chunks:
+            return
+        per_chunk = size / len(self.chunks)
+        # go a bit under the budget, so it does not happen for every chunk
+        count = (size - config.CHUNK_MEMORY_BUDGET * 9 / 10) / per_chunk + 1
+        by_distance = sorted(
+            ((max(abs(x - center[0]), abs(z - center[1])), (x, z)) for x, z in self.chunks),
+            reverse=True)
+        chunks = set()
+        for distance, coords in by_distance[:count]:
+            if distance <= config.CHUNK_KEEP_DISTANCE:
+                break
+            chunks.add(coords)
+        if not chunks:
+            return
+        for coords in chunks:
+            del self.chunks[coords]
+            self.can_stand_memory.chunk_change(coords[0], coords[1])
+            navgrid.route_cache.chunk_change(coords[0], coords[1])
+        nodes = navgrid.evict_chunks(chunks)
+        self.chunks_evicted += len(chunks)
+        log.msg("evicted %d chunks with %d nodes, %d chunks resident, %d chunks evicted so far, memory %d KB" %
+                (len(chunks), nodes, len(self.chunks), self.chunks_evicted,
+                 (self.memory_size + navgrid.memory_size) / 1024))
+
+    def snapshot(self, coords):
+        """
+        block ids of the chunk and its loaded neighbours as strings, what
+        a navgrid seed worker needs
+        """
+        out = []
+        for i, j in [(0, 0)] + tools.adjacency:
+            chunk = self.chunks.get((coords[0] + i, coords[1] + j), None)
+            if chunk is not None:
+                out.append((chunk.coords, chunk.complete,
+                            tuple(None if level is None else str(level) for level in chunk.blocks)))
+        return out
 
     def load_bulk_chunk(self, metas, data_array):
-        data_start = 0
-        data_end = 0
-        for meta in metas:
-            for i in xrange(Chunk.levels):
-                if meta.primary_bitmap & 1 << i:
-                    data_end += 4096 + 4096 + 2048
-            data_end += 256
-            self.load_chunk(meta.x, meta.z, True, meta.primary_bitmap, meta.add_bitmap, data_array[data_start:data_end], update_after=False)
-            data_start = data_end
+        offset = 0
+        updated = []
         for meta in metas:
-            self.chunk_updated(meta.x, meta.z)
+            offset = self.load_chunk(meta.x, meta.z, True, meta.primary_bitmap, meta.add_bitmap, data_array,
+                                     update_after=False, offset=offset, updated=updated)
+        for x, z in updated:
+            self.chunk_updated(x, z)
 
     def chunk_array_position(self, x, y, z):
         """ compute index from 3D to 1D """
         return y * 256 + z * 16 + x
 
-    def change_block_to(self, x, y, z, block_type, meta):
-        current_block = self.get_block(x, y, z)
-        if current_block is None:
-            log.err("change_block block %s type %s meta %s is None" %
-                    ((x, y, z), block_type, meta))
-            return None, None
-        if current_block.is_sign and not current_block.number == block_type:
-            self.world.navgrid.sign_waypoints.remove(current_block.coords)
-        cx = x & 15
-        y_level = current_block.y >> 4
-        cy = y & 15
-        cz = z & 15
-        pos = self.chunk_array_position(cx, cy, cz)
-        chunk_x = x >> 4
-        chunk_z = z >> 4
-        if (chunk_x, chunk_z) not in self.chunks:
-            chunk = Chunk((chunk_x, chunk_z))
-            self.chunks[(chunk_x, chunk_z)] = chunk
-        else:
-            chunk = self.get_chunk((chunk_x, chunk_z))
-        if chunk.blocks[y_level] is None:
-            chunk.fill_level(y_level)
-        chunk.blocks[y_level][pos] = block_type
-        chunk.meta[y_level][pos] = meta
-        new_block = self.get_block(x, y, z)
-        return current_block, new_block
+    def change_blocks(self, changes):
+        """
+        write all (x, y, z, block id, meta) changes to the chunks first,
+        then remove the signs that are gone and update caches and navgrid
+        once for the whole batch
+        """
+        navgrid = self.world.navgrid
+        signs = set()
+        sections = set()
+        changed = []
+        for x, y, z, block_id, meta in changes:
+            if y < 0 or y > 255:
+                continue
+            chunk = self.get_chunk((x >> 4, z >> 4), auto_create=True)
+            y_level = y >> 4
+            if chunk.blocks[y_level] is None:
+                chunk.fill_level(y_level)
+            pos = self.chunk_array_position(x & 15, y & 15, z & 15)
+            current = chunk.blocks[y_level][pos]
+            if current != block_id and blocks.block_types[current << 4].is_sign:
+                signs.add((x, y, z))
+            chunk.blocks[y_level][pos] = block_id
+            chunk.meta[y_level][pos] = meta
+            chunk.section_changed(y_level, block_id)
+            if self.cache is not None:
+                self.cache.block_change(x, y, z, block_id, meta)
+            self.can_stand_memory.block_change(x, y, z)
+            sections.add((x >> 4, y >> 4, z >> 4))
+            changed.append((x, y, z))
+        for crd in signs:
+            navgrid.sign_waypoints.remove(crd)
+        for section in sections:
+            navgrid.route_cache.section_change(section)
+        navgrid.blocks_change(changed)
 
     def block_change(self, x, y, z, btype, bmeta):
-        ob, nb = self.change_block_to(x, y, z, btype, bmeta)
-        self.world.navgrid.block_change(ob, nb)
+        self.change_blocks([(x, y, z, btype, bmeta)])
 
     def multi_block_change(self, chunk_x, chunk_z, blocks):
         shift_x = chunk_x << 4
         shift_z = chunk_z << 4
-        changed = []
-        for block in blocks:
-            ob, nb = self.change_block_to(block.x + shift_x, block.y, block.z + shift_z, block.block_id, block.meta)
-            changed.append((ob, nb))
-        for ob, nb in changed:
-            self.world.navgrid.block_change(ob, nb)
+        self.change_blocks([(block.x + shift_x, block.y, block.z + shift_z, block.block_id, block.meta)
+                            for block in blocks])
 
     def sign(self, x, y, z, line1, line2, line3, line4):
         sign = tools.Sign((x, y, z), line1, line2, line3, line4)
@@ -212,14 +393,10 @@ class Grid(object):
             self.world.navgrid.sign_waypoints.new(sign)
 
     def explosion(self, x, y, z, records):
+        destroyed = set()
         for rec in records:
-            rx = x + rec.x
-            ry = y + rec.y
-            rz = z + rec.z
-            gx = int(rx)
-            gy = int(ry)
-            gz = int(rz)
-            self.block_change(gx, gy, gz, 0, 0)
+            destroyed.add((int(x + rec.x), int(y + rec.y), int(z + rec.z)))
+        self.change_blocks([(gx, gy, gz, 0, 0) for gx, gy, gz in destroyed])
 
     def chunk_complete_at(self, crd):
         chunk = self.get_chunk(crd)
@@ -228,27 +405,97 @@ class Grid(object):
         else:
             return chunk.complete
 
-    def blocks_in_aabb(self, bb):
-        out = []
-        for x, y, z in bb.grid_area:
-            blk = self.get_block(x, y, z)
-            if blk is not None:
-                out.append(blk)
-        return out
+    def indexes_in_aabb(self, bb, mask=0):
+        """
+        (x, y, z, block index) of the blocks in the bounding box with any of
+        the mask flags, any block but air when mask is 0. sections whose
+        summary rules them out are not looked into. same order as grid_area
+        """
+        x0, y0, z0, x1, y1, z1 = bb.grid_box
+        y0 = max(y0, 0)
+        y1 = min(y1, config.WORLD_HEIGHT - 1)
+        sections = {}
+        for cx in xrange(x0 >> 4, (x1 >> 4) + 1):
+            for cz in xrange(z0 >> 4, (z1 >> 4) + 1):
+                chunk = self.chunks.get((cx, cz), None)
+                for level in xrange(y0 >> 4, (y1 >> 4) + 1):
+                    if chunk is None or chunk.blocks[level] is None:
+                        continue
+                    if mask:
+                        if not chunk.section_flags[level] & mask:
+                            continue
+                    elif chunk.section_ids[level] == 0:
+                        continue
+                    sections[(cx, level, cz)] = (chunk.blocks[level], chunk.meta[level])
+        if not sections:
+            return
+        block_flags = blocks.block_flags
+        z_parts = [(cz, xrange(max(z0, cz << 4), min(z1, (cz << 4) | 15) + 1))
+                   for cz in xrange(z0 >> 4, (z1 >> 4) + 1)]
+        for x in xrange(x0, x1 + 1):
+            cx = x >> 4
+            lx = x & 15
+            for y in xrange(y0, y1 + 1):
+                level = y >> 4
+                ly = ((y & 15) << 8) | lx
+                for cz, zs in z_parts:
+                    section = sections.get((cx, level, cz), None)
+                    if section is None:
+                        continue
+                    ids, metas = section
+                    for z in zs:
+                        pos = ly | ((z & 15) << 4)
+                        index = (ids[pos] << 4) | metas[pos]
+                        if (block_flags[index] & mask) if mask else index >= 16:
+                            yield x, y, z, index
+
+    def blocks_in_aabb(self, bb, mask=0):
+        """
+        blocks other than air, air never collides or affects movement.
+        with mask only the blocks that have some of the mask flags
+        """
+        block_map = blocks.block_map
+        return [block_map[index >> 4](self, x, y, z, index & 15)
+                for x, y, z, index in self.indexes_in_aabb(bb, mask)]
+
+    def block_types_in_aabb(self, bb, mask=0):
+        block_types = blocks.block_types
+        for _, _, _, index in self.indexes_in_aabb(bb, mask):
+            yield block_types[index]
+
+    def aabb_flags(self, bb, mask=0):
+        """
+        blocks.block_flags of all blocks in the bounding box or-ed together,
+        exact for the mask flags when mask is given
+        """
+        block_flags = blocks.block_flags
+        flags = 0
+        for _, _, _, index in self.indexes_in_aabb(bb, mask):
+            flags |= block_flags[index]
+        return flags
 
     def is_any_liquid(self, bb):
-        for blk in self.blocks_in_aabb(bb):
-            if blk.material.is_liquid:
-                return True
-        return False
+        return self.aabb_flags(bb, blocks.LIQUID) & blocks.LIQUID != 0
 
     def aabb_collides(self, bb):
-        ebb = bb.extend_to(dy=-1)
-        for block in self.blocks_in_aabb(ebb):
-            if block.collides_with(bb):
+        block_local_bb = blocks.block_local_bb
+        local_box = blocks.LOCAL_BOX
+        for x, y, z, index in self.indexes_in_aabb(bb.extend_to(dy=-1), blocks.COLLIDABLE):
+            if blocks.block_flags[index] & local_box:
+                if bb.collides_at(block_local_bb[index], x, y, z):
+                    return True
+            elif self.get_block(x, y, z).collides_with(bb):
                 return True
         return False
 
+    def block_max_y(self, index, x, y, z):
+        """
+        top of the block at x, y, z with index from get_block_index
+        """
+        if blocks.block_flags[index] & blocks.LOCAL_BOX:
+            return blocks.block_local_bb[index].max_y + y
+        return self.get_block(x, y, z).max_y
+
     def passing_blocks_between(self, bb1, bb2):
         out = []
         ubb = bb1.union(bb2)
@@ -263,7 +510,7 @@ class Grid(object):
 
     def min_collision_between(self, bb1, bb2, horizontal=False, max_height=False):
         ubb = bb1.extend_to(dy=-1).union(bb2.extend_to(dy=-1))
-        blcks = self.blocks_in_aabb(ubb)
+        blcks = self.blocks_in_aabb(ubb, blocks.COLLIDABLE)
         dvect = bb1.vector_to(bb2)
         if horizontal:
             dvect = (dvect[0], 0, dvect[2])
@@ -286,7 +533,7 @@ class Grid(object):
 
     def collision_between(self, bb1, bb2, debug=False):
         ubb = bb1.extend_to(dy=-1).union(bb2.extend_to(dy=-1))
-        blcks = self.blocks_in_aabb(ubb)
+        blcks = self.blocks_in_aabb(ubb, blocks.COLLIDABLE)
         dvect = bb1.vector_to(bb2)
         for blk in blcks:
             col, _, _ = blk.sweep_collision(bb1, dvect, debug=debug)
@@ -296,26 +543,22 @@ class Grid(object):
 
     def aabbs_in(self, bb1):
         out = []
-        blcks = self.blocks_in_aabb(bb1.extend_to(0, -1, 0))
+        blcks = self.blocks_in_aabb(bb1.extend_to(0, -1, 0), blocks.COLLIDABLE)
         for blk in blcks:
             blk.add_grid_bounding_boxes_to(out)
         return out
 
     def aabb_on_ladder(self, bb):
-        blk = self.get_block(bb.grid_x, bb.grid_y, bb.grid_z)
-        return blk.number == blocks.Ladders.number or blk.number == blocks.Vines.number
+        index = self.get_block_index(bb.grid_x, bb.grid_y, bb.grid_z)
+        return blocks.block_flags[index] & blocks.LADDER_VINE != 0
 
     def aabb_in_water(self, bb):
-        for blk in self.blocks_in_aabb(bb):
-            if blk.is_water:
-                return True
-        return False
+        return self.aabb_flags(bb, blocks.WATER) & blocks.WATER != 0
 
     def standing_on_solidblock(self, bb):
         standing_on = None
-        blocks = self.blocks_in_aabb(bb.extend_to(dy=-1))
         dvect = (0, -1, 0)
-        for blk in blocks:
+        for blk in self.blocks_in_aabb(bb.extend_to(dy=-1), blocks.COLLIDABLE):
             col, rel_d, _ = blk.sweep_collision(bb, dvect)
             if col and fops.eq(rel_d, 0):
                 standing_on = blk
@@ -349,7 +592,7 @@ class Grid(object):
 
     def check_sign(self, sign):
         crd = sign.coords
-        sblk = self.get_block(crd[0], crd[1], crd[2])
+        sblk = self.get_block_type(crd[0], crd[1], crd[2])
         if not sblk.is_sign:
             self.world.navgrid.sign_waypoints.remove(crd)
             return False
@@ -359,7 +602,7 @@ class Grid(object):
     def aabb_eyelevel_inside_water(self, bb, eye_height=config.PLAYER_EYELEVEL):
         eye_y = bb.min_y + eye_height
         ey = tools.grid_shift(eye_y)
-        blk = self.get_block(bb.grid_x, ey, bb.grid_z)
+        blk = self.get_block_type(bb.grid_x, ey, bb.grid_z)
         if blk.is_water:
             wh = blk.height_percent - 0.11111111
             return eye_y < (ey + 1 - wh)
@@ -1,5 +1,7 @@
 
 
+from collections import OrderedDict
+
 import fops
 import logbot
 import blocks
@@ -10,6 +12,157 @@ from axisbox import AABB
 log = logbot.getlogger("GRIDSPACE")
 
 
+class CanStandMemory(object):
+    """
+    remembers can_stand_on results per coordinates and per signature, the
+    (id, meta) of the blocks from one under to three above. signature is
+    used only when none of these blocks has geometry that depends on
+    the neighbours, then the result does not depend on anything else.
+    values are kept relative to the block coordinates.
+    """
+    def __init__(self, limit=config.CAN_STAND_MEMORY):
+        self.limit = limit
+        self.signatures = OrderedDict()
+        self.chunks = {}
+        self.coords_hits = 0
+        self.signature_hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return "can stand memory coords hits %d signature hits %d misses %d signatures %d" % \
+            (self.coords_hits, self.signature_hits, self.misses, len(self.signatures))
+
+    def signature(self, grid, x, y, z):
+        sig = 0
+        for i in xrange(-1, 4):
+            index = grid.get_block_index(x, y + i, z)
+            flags = blocks.block_flags[index]
+            if flags & blocks.COLLIDABLE and not flags & blocks.LOCAL_BOX:
+                return None
+            sig = (sig << 12) | index
+        return sig
+
+    def compute(self, gs):
+        x, y, z = gs.coords
+        chunk = self.chunks.get((x >> 4, z >> 4), None)
+        if chunk is None:
+            chunk = self.chunks[(x >> 4, z >> 4)] = {}
+        value = chunk.get(gs.coords, None)
+        if value is not None:
+            self.coords_hits += 1
+            return self.restore(gs, value)
+        sig = self.signature(gs.grid, x, y, z)
+        if sig is not None:
+            value = self.signatures.get(sig, None)
+            if value is not None:
+                self.signature_hits += 1
+                chunk[gs.coords] = value
+                return self.restore(gs, value)
+        self.misses += 1
+        can = gs._can_stand_on()
+        if gs.stand_block is None:
+            stand_dy = None
+        else:
+            stand_dy = gs.stand_block.y - y
+        value = (can,
+                 gs.bb_stand - gs.coords if gs.bb_stand is not None else None,
+                 gs.platform - gs.coords if gs.platform is not None else None,
+                 stand_dy)
+        chunk[gs.coords] = value
+        if sig is not None:
+            if len(self.signatures) >= self.limit:
+                self.signatures.popitem(last=False)
+            self.signatures[sig] = value
+        return can
+
+    def restore(self, gs, value):
+        can, bb_stand, platform, stand_dy = value
+        if bb_stand is not None:
+            gs.bb_stand = bb_stand + gs.coords
+        if platform is not None:
+            gs.platform = platform + gs.coords
+        if stand_dy == 0:
+            gs.stand_block = gs.block
+        elif stand_dy is not None:
+            x, y, z = gs.coords
+            gs.stand_block = gs.grid.get_block(x, y + stand_dy, z)
+        return can
+
+    def block_change(self, x, y, z):
+        """
+        forget positions that can see block at x, y, z
+        """
+        for i, j in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            chunk = self.chunks.get(((x + i) >> 4, (z + j) >> 4), None)
+            if chunk is None:
+                continue
+            for k in xrange(-3, 2):
+                chunk.pop((x + i, y + k, z + j), None)
+
+    def chunk_change(self, chunk_x, chunk_z):
+        """
+        forget the chunk and its neighbours, they can see over the border
+        """
+        for i, j in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            self.chunks.pop((chunk_x + i, chunk_z + j), None)
+
+
+class CanGoMemory(object):
+    """
+    remembers can_go results and edge costs keyed on the offset between
+    the two spaces and the (id, meta) of every block the edge check can
+    look at, one under the lower space up to three above the higher one
+    in the columns between them. like CanStandMemory it is used only when
+    none of these blocks needs its neighbours for geometry. key changes
+    with any block change in the volume, so there is nothing to invalidate.
+    """
+    def __init__(self, limit=config.CAN_GO_MEMORY):
+        self.limit = limit
+        self.signatures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def __str__(self):
+        return "can go memory hits %d misses %d uncached %d signatures %d" % \
+            (self.hits, self.misses, self.uncached, len(self.signatures))
+
+    def signature(self, grid, crd1, crd2):
+        sig = 0
+        block_flags = blocks.block_flags
+        for x in xrange(min(crd1[0], crd2[0]), max(crd1[0], crd2[0]) + 1):
+            for z in xrange(min(crd1[2], crd2[2]), max(crd1[2], crd2[2]) + 1):
+                for y in xrange(min(crd1[1], crd2[1]) - 1, max(crd1[1], crd2[1]) + 4):
+                    index = grid.get_block_index(x, y, z)
+                    flags = block_flags[index]
+                    if flags & blocks.COLLIDABLE and not flags & blocks.LOCAL_BOX:
+                        return None
+                    sig = (sig << 12) | index
+        return sig
+
+    def compute(self, gs_from, gs_to, update_to_bb_stand=False):
+        crd1 = gs_from.coords
+        crd2 = gs_to.coords
+        sig = self.signature(gs_from.grid, crd1, crd2)
+        if sig is None:
+            self.uncached += 1
+            return gs_from._can_go(gs_to, update_to_bb_stand=update_to_bb_stand)
+        key = (crd2[0] - crd1[0], crd2[1] - crd1[1], crd2[2] - crd1[2], sig)
+        value = self.signatures.get(key, None)
+        if value is not None:
+            self.hits += 1
+            can, edge_cost = value
+            if can:
+                gs_from.edge_cost = edge_cost
+            return can
+        self.misses += 1
+        can = gs_from._can_go(gs_to, update_to_bb_stand=update_to_bb_stand)
+        if len(self.signatures) >= self.limit:
+            self.signatures.popitem(last=False)
+        self.signatures[key] = (can, gs_from.edge_cost if can else None)
+        return can
+
+
 class GridSpace(object):
 
     def __init__(self, grid, coords=None, block=None, bb=None):
@@ -29,9 +182,6 @@ class GridSpace(object):
             self.coords = self.block.coords
         else:
             raise Exception("Empty gridspace object")
-        self.blocks3 = (self.block,
-                        self.grid.get_block(self.coords[0], self.coords[1] + 1, self.coords[2]),
-                        self.grid.get_block(self.coords[0], self.coords[1] + 2, self.coords[2]))
         self._can_stand_on_value = None
         self.stand_block = None
         self.platform = None
@@ -46,10 +196,27 @@ class GridSpace(object):
     def __eq__(self, other):
         return self.coords == other.coords
 
+    @property
+    def blocks3(self):
+        return (self.block,
+                self.grid.get_block_type(self.coords[0], self.coords[1] + 1, self.coords[2]),
+                self.grid.get_block_type(self.coords[0], self.coords[1] + 2, self.coords[2]))
+
     @property
     def b3(self):
         return "%s %s" % (self.block.coords, ", ".join([b.name for b in self.blocks3]))
 
+    def block_platform(self, flags):
+        """
+        top face of self.block, straight from the local box table if possible
+        """
+        if flags & blocks.LOCAL_BOX:
+            box = blocks.block_local_bb[(self.block.number << 4) | self.block.meta]
+            x, y, z = self.coords
+            return AABB(box.min_x + x, box.max_y + y, box.min_z + z,
+                        box.max_x + x, box.max_y + y, box.max_z + z)
+        return self.block.maxedge_platform(y=1)
+
     def blocks_to_avoid(self, blks):
         for b in blks:
             if isinstance(b, blocks.Cobweb) or isinstance(b, blocks.Fire) or isinstance(b, blocks.BlockLava):
@@ -64,14 +231,12 @@ class GridSpace(object):
         return self._can_stand_on_value
 
     def compute(self):
-        can = self._can_stand_on()
-        #self.grid.can_stand_memory[[b.identifier for b in self.blocks3]] = can
-        return can
+        return self.grid.can_stand_memory.compute(self)
 
     def can_be_in(self, bb):
         if self.grid.aabb_collides(bb):
             return False
-        if self.blocks_to_avoid(self.grid.blocks_in_aabb(bb)):
+        if self.grid.aabb_flags(bb) & blocks.AVOID:
             return False
         if self.grid.aabb_eyelevel_inside_water(bb):
             return False
@@ -81,17 +246,20 @@ class GridSpace(object):
         """
         can stand on top of the center of the block
         """
-        if isinstance(self.block, blocks.Cactus):
+        x, y, z = self.coords
+        if self.block.number == blocks.Cactus.number:
             return False
-        under = self.grid.get_block(self.coords[0], self.coords[1] - 1, self.coords[2])
-        if not self.block.collidable and not under.is_fence and not self.block.is_water and not self.block.is_ladder_vine:
+        flags = blocks.block_flags[(self.block.number << 4) | self.block.meta]
+        under_index = self.grid.get_block_index(x, y - 1, z)
+        under_flags = blocks.block_flags[under_index]
+        if not flags & (blocks.COLLIDABLE | blocks.WATER | blocks.LADDER_VINE) and not under_flags & blocks.FENCE:
             return False
-        if self.block.is_ladder_vine or self.block.is_water:
-            bb = AABB.from_block_coords(self.block.coords)
-            if under.is_fence:
-                self.bb_stand = bb.shift(min_y=under.max_y)
+        if flags & (blocks.LADDER_VINE | blocks.WATER):
+            bb = AABB.from_block_coords(self.coords)
+            if under_flags & blocks.FENCE:
+                self.bb_stand = bb.shift(min_y=self.grid.block_max_y(under_index, x, y - 1, z))
             else:
-                if not under.collidable or (under.collidable and fops.lt(under.max_y, bb.min_y)):
+                if not under_flags & blocks.COLLIDABLE or fops.lt(self.grid.block_max_y(under_index, x, y - 1, z), bb.min_y):
                     bb1 = bb.offset(dy=0.5)
                     if self.can_be_in(bb1):
                         bb = bb1
@@ -99,10 +267,11 @@ class GridSpace(object):
             self.stand_block = self.block
             self.platform = self.bb_stand.set_to(max_y=self.bb_stand.min_y)
         else:
-            if under.is_fence:
+            if under_flags & blocks.FENCE:
+                under = self.grid.get_block(x, y - 1, z)
                 fence_top = under.maxedge_platform(y=1)
-                if self.block.collidable:
-                    self.platform = self.block.maxedge_platform(y=1)
+                if flags & blocks.COLLIDABLE:
+                    self.platform = self.block_platform(flags)
                     self.stand_block = self.block
                     if fence_top.min_y > self.platform.min_y:
                         self.platform = fence_top
@@ -111,9 +280,9 @@ class GridSpace(object):
                     self.platform = fence_top
                     self.stand_block = under
             else:
-                self.platform = self.block.maxedge_platform(y=1)
+                self.platform = self.block_platform(flags)
                 self.stand_block = self.block
-            bb = AABB.from_block_coords(self.block.coords)
+            bb = AABB.from_block_coords(self.coords)
             self.bb_stand = bb.offset(dy=self.platform.min_y - bb.min_y)
             if not self.bb_stand.collides_on_axes(self.platform, x=True, z=True):
                 return False
@@ -121,6 +290,9 @@ class GridSpace(object):
 
     def can_go(self, gs, update_to_bb_stand=False):
         self.can_stand_on
+        return self.grid.can_go_memory.compute(self, gs, update_to_bb_stand=update_to_bb_stand)
+
+    def _can_go(self, gs, update_to_bb_stand=False):
         if not self.can_stand_between(gs):
             return False
         if not self.can_go_between(gs, update_to_bb_stand=update_to_bb_stand):
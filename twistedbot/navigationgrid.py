@@ -1,16 +1,68 @@
 ﻿
-from collections import defaultdict, OrderedDict
+import os
+import math
+import time
+import heapq
+import weakref
+import binascii
+import traceback
+import multiprocessing
+from array import array
+from collections import defaultdict, OrderedDict, deque
 
-from twisted.internet.task import cooperate
+from twisted.internet import reactor
 
 import tools
+import config
 import logbot
+import blocks
 from signwaypoints import SignWayPoints
 from gridspace import GridSpace
 
 
 log = logbot.getlogger("navgrid")
 
+INF = float('inf')
+
+SEED_CLEAR = 0  # block kinds for chunk seeding, nothing to collide with or to avoid
+SEED_SOLID = 1  # plain full cube
+SEED_OTHER = 2  # anything else, left to GridSpace
+SEED_NOT = 0  # block states for chunk seeding, cannot stand on
+SEED_STAND = 1  # can stand on
+SEED_UNKNOWN = 2  # needs GridSpace
+SEED_LEVEL = 256  # blocks in one level of a chunk
+SEED_LEVELS = 260  # levels in seed arrays, one under the world and three above
+
+
+def seed_kind(number):
+    """
+    SEED_* kind of block id, SEED_OTHER when it depends on meta
+    """
+    if blocks.block_map[number] is None:
+        return SEED_OTHER
+    kinds = set()
+    for meta in xrange(16):
+        index = (number << 4) | meta
+        flags = blocks.block_flags[index]
+        box = blocks.block_local_bb[index]
+        if not flags & (blocks.COLLIDABLE | blocks.WATER | blocks.LIQUID | blocks.FENCE | blocks.LADDER_VINE | blocks.AVOID):
+            kinds.add(SEED_CLEAR)
+        elif flags == blocks.COLLIDABLE | blocks.LOCAL_BOX and number != blocks.Cactus.number and \
+                (box.min_x, box.min_y, box.min_z, box.max_x, box.max_y, box.max_z) == (0, 0, 0, 1, 1, 1):
+            kinds.add(SEED_SOLID)
+        else:
+            kinds.add(SEED_OTHER)
+    if len(kinds) == 1:
+        return kinds.pop()
+    return SEED_OTHER
+
+
+seed_kinds = bytearray(seed_kind(number) for number in xrange(256))
+seed_solid_table = str(bytearray(1 if kind == SEED_SOLID else 0 for kind in seed_kinds))
+seed_clear_table = str(bytearray(1 if kind == SEED_CLEAR else 0 for kind in seed_kinds))
+seed_ones = long('01' * SEED_LEVEL * SEED_LEVELS, 16)
+seed_empty_level = bytearray(4096)
+
 
 class ChunkBorders(object):
     def __init__(self):
@@ -34,12 +86,136 @@ class ChunkBorders(object):
                 except KeyError:
                     pass
 
+    def remove_chunk(self, chunk):
+        """
+        forget records from the chunk, records pointing into it are kept
+        for the time it is loaded again
+        """
+        self.borders.pop(chunk, None)
+
     def between(self, chunk_from, chunk_to):
         ch_diff = self.chunk_diff(chunk_from, chunk_to)
         for crd in self.borders[chunk_from][ch_diff]:
             yield crd
 
 
+class ChunkGraph(object):
+    """
+    chunk level abstraction of the navigation graph. edges crossing a chunk
+    border are grouped into runs of neighbouring edges to the same chunk,
+    the middle edge of a run is an exit. both ends of exits are entrance
+    nodes, costs between entrances of one chunk are computed only inside
+    that chunk and kept until the graph in the chunk or next to it changes.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.exits = {}
+        self.exits_from = {}
+        self.paths = {}
+        self.computed = 0
+
+    def changed(self, crd):
+        """
+        edges of the node at crd changed
+        """
+        self.chunk_changed((crd[0] >> 4, crd[2] >> 4))
+
+    def chunk_changed(self, chunk):
+        if self.exits.pop(chunk, None) is not None:
+            del self.exits_from[chunk]
+        self.paths.pop(chunk, None)
+        for i, j in tools.adjacency:
+            self.paths.pop((chunk[0] + i, chunk[1] + j), None)
+
+    def border_nodes(self, chunk):
+        return self.graph.border.get(chunk, ())
+
+    def get_exits(self, chunk):
+        """
+        [(from coords, to coords, cost)] leaving the chunk
+        """
+        exits = self.exits.get(chunk, None)
+        if exits is not None:
+            return exits
+        crossing = []
+        for crd in self.border_nodes(chunk):
+            for to, cost in self.graph.get_succ(crd):
+                to_chunk = to[0] >> 4, to[2] >> 4
+                if to_chunk != chunk:
+                    crossing.append((to_chunk, crd[0] + crd[2], crd[1], crd, to, cost))
+        crossing.sort()
+        exits = []
+        run = []
+        for edge in crossing:
+            if run:
+                last = run[-1]
+                if last[0] != edge[0] or edge[1] - last[1] > 1 or abs(edge[2] - last[2]) > 1:
+                    exits.append(run[len(run) / 2][3:])
+                    run = []
+            run.append(edge)
+        if run:
+            exits.append(run[len(run) / 2][3:])
+        self.exits[chunk] = exits
+        exits_from = defaultdict(list)
+        for crd, to, cost in exits:
+            exits_from[crd].append((to, cost))
+        self.exits_from[chunk] = exits_from
+        return exits
+
+    def get_exits_from(self, crd):
+        chunk = crd[0] >> 4, crd[2] >> 4
+        self.get_exits(chunk)
+        return self.exits_from[chunk].get(crd, ())
+
+    def entrances(self, chunk):
+        out = set(crd for crd, _, _ in self.get_exits(chunk))
+        for i, j in tools.adjacency:
+            for _, to, _ in self.get_exits((chunk[0] + i, chunk[1] + j)):
+                if (to[0] >> 4, to[2] >> 4) == chunk:
+                    out.add(to)
+        return out
+
+    def get_paths(self, chunk):
+        """
+        {entrance: [(entrance, cost)]} inside the chunk
+        """
+        paths = self.paths.get(chunk, None)
+        if paths is not None:
+            return paths
+        entrances = self.entrances(chunk)
+        paths = {}
+        for crd in entrances:
+            costs = self.costs_in_chunk(crd, chunk, entrances)
+            paths[crd] = [(to, cost) for to, cost in costs.iteritems() if to != crd]
+        self.paths[chunk] = paths
+        self.computed += 1
+        return paths
+
+    def costs_in_chunk(self, start, chunk, targets, reverse=False):
+        """
+        dijkstra from start over nodes in the chunk, returns costs to
+        the targets that were reached
+        """
+        step = self.graph.get_pred if reverse else self.graph.get_succ
+        dist = {start: 0}
+        heap = [(0, start)]
+        found = {}
+        while heap and len(found) < len(targets):
+            d, crd = heapq.heappop(heap)
+            if d > dist[crd]:
+                continue
+            if crd in targets:
+                found[crd] = d
+            for to, cost in step(crd):
+                if (to[0] >> 4, to[2] >> 4) != chunk:
+                    continue
+                nd = d + cost
+                if nd < dist.get(to, nd + 1):
+                    dist[to] = nd
+                    heapq.heappush(heap, (nd, to))
+        return found
+
+
 class GridEdge(object):
     __slots__ = ('cost')
 
@@ -47,39 +223,1205 @@ class GridEdge(object):
         self.cost = cost
 
 
-class GridNode(object):
-    __slots__ = ('area_id')
+class NavigationAreas(object):
+    """
+    weakly connected components of the navigation graph. node area ids
+    are kept in a union-find, new edges merge areas. when an edge or node
+    is removed a short search checks that its neighbours are still
+    connected, a neighbourhood that runs out is split off as a new area,
+    otherwise the area is marked dirty. dirty areas are searched from
+    both nodes when asked about, over the limit they count as connected.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.node_area = {}
+        self.parent = []
+        self.size = []
+        self.dirty = set()
+        self.splits = 0
 
-    def __init__(self):
-        self.area_id = None
+    def __str__(self):
+        return "areas %d dirty %d splits %d" % \
+            (len([a for a, p in enumerate(self.parent) if a == p and self.size[a] > 0]), len(self.dirty), self.splits)
+
+    def new_area(self, size):
+        area = len(self.parent)
+        self.parent.append(area)
+        self.size.append(size)
+        return area
+
+    def find(self, area):
+        parent = self.parent
+        root = area
+        while parent[root] != root:
+            root = parent[root]
+        while parent[area] != root:
+            parent[area], area = root, parent[area]
+        return root
+
+    def area_id(self, crd):
+        area = self.node_area.get(crd, None)
+        if area is None:
+            area = self.node_area[crd] = self.new_area(1)
+            return area
+        root = self.find(area)
+        if root != area:
+            self.node_area[crd] = root
+        return root
+
+    def union(self, crd1, crd2):
+        a1 = self.area_id(crd1)
+        a2 = self.area_id(crd2)
+        if a1 == a2:
+            return
+        if self.size[a1] < self.size[a2]:
+            a1, a2 = a2, a1
+        self.parent[a2] = a1
+        self.size[a1] += self.size[a2]
+        if a2 in self.dirty:
+            self.dirty.discard(a2)
+            self.dirty.add(a1)
+
+    def split(self, area, crds):
+        new = self.new_area(len(crds))
+        for crd in crds:
+            self.node_area[crd] = new
+        self.size[area] -= len(crds)
+        self.splits += 1
+
+    def restore(self, crds, dirty):
+        """
+        crds were one area when the navgrid snapshot was taken
+        """
+        area = self.new_area(len(crds))
+        for crd in crds:
+            self.node_area[crd] = area
+        if dirty:
+            self.dirty.add(area)
+
+    def neighbours(self, crd):
+        for to, _ in self.graph.get_succ(crd):
+            yield to
+        for to, _ in self.graph.get_pred(crd):
+            yield to
+
+    def search(self, crd1, crd2, limit):
+        """
+        search from both nodes, True when they meet, None over the limit.
+        when one side runs out it is a whole component, it is split off
+        as a new area and the result is False
+        """
+        seen = [set([crd1]), set([crd2])]
+        frontier = [[crd1], [crd2]]
+        while frontier[0] and frontier[1]:
+            if len(seen[0]) + len(seen[1]) > limit:
+                return None
+            side = 0 if len(seen[0]) <= len(seen[1]) else 1
+            other = seen[1 - side]
+            next_frontier = []
+            for crd in frontier[side]:
+                for to in self.neighbours(crd):
+                    if to in other:
+                        return True
+                    if to not in seen[side]:
+                        seen[side].add(to)
+                        next_frontier.append(to)
+            frontier[side] = next_frontier
+        self.split(self.area_id(crd1), seen[0] if not frontier[0] else seen[1])
+        return False
+
+    def check_connected(self, crds):
+        """
+        check that the former neighbours of a removed edge or node are still
+        in one area, components that got cut off become new areas
+        """
+        crds = [crd for crd in crds if self.graph.has_node(crd)]
+        while len(crds) > 1:
+            first = crds[0]
+            for crd in crds[1:]:
+                if self.area_id(crd) != self.area_id(first):
+                    continue
+                if self.search(first, crd, config.AREA_CHECK_LIMIT) is None:
+                    self.dirty.add(self.area_id(first))
+                    return
+            crds = [crd for crd in crds if self.area_id(crd) != self.area_id(first)]
+
+    def edge_removed(self, crd1, crd2):
+        if not self.graph.has_edge(crd2, crd1):
+            self.check_connected([crd1, crd2])
+
+    def remove_node(self, crd, neighbours=None):
+        """
+        without neighbours the area is marked dirty
+        """
+        area = self.node_area.pop(crd, None)
+        if area is None:
+            return
+        area = self.find(area)
+        self.size[area] -= 1
+        if neighbours is None:
+            self.dirty.add(area)
+        else:
+            self.check_connected(list(neighbours))
+
+    def same_area(self, crd1, crd2):
+        area = self.area_id(crd1)
+        if area != self.area_id(crd2):
+            return False
+        if area not in self.dirty:
+            return True
+        return self.search(crd1, crd2, config.AREA_SEARCH_LIMIT) is not False
+
+
+class Landmarks(object):
+    """
+    distances to and from landmark nodes for the ALT heuristic. landmarks
+    are waypoint signs spread out by farthest point selection, tables are
+    float32 arrays indexed by graph node id. an entry counts only while
+    its id has the generation it had when the entry was written, other
+    entries are unknown. removed edges and higher costs leave the tables
+    lower bounds. new edges and lower costs break them until repair has
+    lowered the entries of their ends and of what lies behind them,
+    meanwhile the tables are stale. a refresh some time after the graph
+    changes computes tight tables in the background and swaps them in,
+    they are repaired for the edges shortened while it ran.
+    """
+    def __init__(self, navgrid):
+        self.navgrid = navgrid
+        self.graph = navgrid.graph
+        self.landmarks = []
+        self.to_landmark = []
+        self.from_landmark = []
+        self.generation = array('I')
+        self.pending = set()
+        self.since_refresh = None
+        self.scheduled = False
+        self.repairing = False
+        self.changes = 0
+        self.refreshes = 0
+        self.repairs = 0
+
+    def __str__(self):
+        return "landmarks %d refreshes %d repairs %d pending %d memory %d KB" % \
+            (len(self.landmarks), self.refreshes, self.repairs, len(self.pending), self.memory_size / 1024)
+
+    @property
+    def memory_size(self):
+        return sum(len(t) * t.itemsize for t in self.to_landmark + self.from_landmark + [self.generation])
+
+    @property
+    def stale(self):
+        return bool(self.pending or self.graph.shortened)
+
+    def known(self, nid):
+        return nid < len(self.generation) and self.generation[nid] == self.graph.generation[nid]
+
+    def changed(self):
+        self.changes += 1
+        self.take_shortened()
+        if self.pending and not self.repairing:
+            self.repairing = True
+            d = tools.cooperate(self.repair()).whenDone()
+            d.addErrback(logbot.exit_on_error)
+        if not self.scheduled and config.LANDMARKS > 0 and self.navgrid.sign_waypoints.crd_to_sign:
+            self.scheduled = True
+            tools.do_later(config.LANDMARK_REFRESH, self.start_refresh)
+
+    def take_shortened(self):
+        shortened = self.graph.shortened
+        if not shortened:
+            return
+        if self.landmarks:
+            self.pending.update(shortened)
+        if self.since_refresh is not None:
+            self.since_refresh.update(shortened)
+        self.graph.shortened = set()
+
+    def start_refresh(self):
+        d = tools.cooperate(self.refresh()).whenDone()
+        d.addErrback(logbot.exit_on_error)
+
+    def select(self):
+        candidates = sorted(set(sign.nav_coords for sign in self.navgrid.sign_waypoints.crd_to_sign.itervalues()
+                                if self.graph.has_node(sign.nav_coords)))
+        chosen = []
+        while candidates and len(chosen) < config.LANDMARKS:
+            if chosen:
+                crd = max(candidates, key=lambda c: min(tools.distance_sq(c, l) for l in chosen))
+            else:
+                crd = candidates[0]
+            chosen.append(crd)
+            candidates.remove(crd)
+        return chosen
+
+    def refresh(self):
+        if self.graph.shortened is None:
+            self.graph.shortened = set()
+        self.take_shortened()
+        self.since_refresh = set()
+        changes = self.changes
+        generation = array('I', self.graph.generation)
+        landmarks = self.select()
+        to_landmark = []
+        from_landmark = []
+        for crd in landmarks:
+            for tables, reverse in ((to_landmark, True), (from_landmark, False)):
+                table = array('f', [INF]) * len(generation)
+                for _ in self.dijkstra(crd, table, reverse):
+                    yield None
+                tables.append(table)
+        self.take_shortened()
+        self.landmarks = landmarks
+        self.to_landmark = to_landmark
+        self.from_landmark = from_landmark
+        self.generation = generation
+        self.pending = self.since_refresh
+        self.since_refresh = None
+        self.refreshes += 1
+        self.scheduled = False
+        if self.changes != changes:
+            self.changed()
+        elif self.pending and not self.repairing:
+            self.repairing = True
+            d = tools.cooperate(self.repair()).whenDone()
+            d.addErrback(logbot.exit_on_error)
+
+    def dijkstra(self, source, table, reverse):
+        graph = self.graph
+        step = graph.get_pred if reverse else graph.get_succ
+        index = graph.index
+        size = len(table)
+        dist = {source: 0}
+        heap = [(0, source)]
+        while heap:
+            d, crd = heapq.heappop(heap)
+            if d > dist[crd]:
+                continue
+            nid = index.get(crd, None)
+            if nid is None:
+                continue
+            if nid < size:
+                table[nid] = d
+            for to, cost in step(crd):
+                nd = d + cost
+                if nd < dist.get(to, INF):
+                    dist[to] = nd
+                    heapq.heappush(heap, (nd, to))
+            yield None
+
+    def repair(self):
+        """
+        lower the entries of the pending nodes to what their edges allow
+        and pass the lowering on, one table at a time for all of them
+        """
+        index = self.graph.index
+        while True:
+            self.take_shortened()
+            if not self.pending:
+                break
+            to_landmark = self.to_landmark
+            from_landmark = self.from_landmark
+            generation = self.generation
+            tables = to_landmark + from_landmark
+            batch = self.pending
+            self.pending = set()
+            queue = [crd for crd in batch if crd in index]
+            for crd in queue:
+                self.claim(index[crd], tables, generation)
+                for step in (self.graph.get_succ, self.graph.get_pred):
+                    for other, _ in step(crd):
+                        if self.claim(index[other], tables, generation) and other not in batch:
+                            batch.add(other)
+                            queue.append(other)
+            yield None
+            queue = [crd for crd in queue if crd in index]
+            for side, step, back in ((to_landmark, self.graph.get_succ, self.graph.get_pred),
+                                     (from_landmark, self.graph.get_pred, self.graph.get_succ)):
+                for table in side:
+                    for _ in self.lower(queue, table, step, back, tables, generation):
+                        yield None
+            self.repairs += len(queue)
+        self.repairing = False
+
+    def claim(self, nid, tables, generation):
+        """
+        make the entries of nid count, an unknown node starts from INF.
+        true when it was unknown
+        """
+        if nid < len(generation) and generation[nid] == self.graph.generation[nid]:
+            return False
+        size = len(self.graph.generation)
+        if len(generation) < size:
+            grow = size - len(generation)
+            generation.extend(array('I', [0]) * grow)
+            for table in tables:
+                table.extend(array('f', [INF]) * grow)
+        generation[nid] = self.graph.generation[nid]
+        for table in tables:
+            table[nid] = INF
+        return True
+
+    def lower(self, crds, table, step, back, tables, generation):
+        """
+        entries of crds in table from the nodes step leads to, lowered
+        entries are passed on to the nodes back leads to. nodes that are
+        still unknown on the way get pending.
+        """
+        index = self.graph.index
+        heap = []
+        for crd in crds:
+            nid = index.get(crd, None)
+            if nid is None:
+                continue
+            best = table[nid]
+            for other, cost in step(crd):
+                d = table[index[other]] + cost
+                if d < best:
+                    best = d
+            if best < table[nid]:
+                table[nid] = best
+            if best < INF:
+                heap.append((table[nid], crd))
+        heapq.heapify(heap)
+        while heap:
+            d, crd = heapq.heappop(heap)
+            nid = index.get(crd, None)
+            if nid is None or d > table[nid]:
+                continue
+            for other, cost in back(crd):
+                oid = index[other]
+                if self.claim(oid, tables, generation):
+                    self.pending.add(other)
+                if d + cost < table[oid]:
+                    table[oid] = d + cost
+                    heapq.heappush(heap, (table[oid], other))
+            yield None
+
+    def active(self, start, goal, count=config.LANDMARKS_ACTIVE):
+        """
+        [(to table, from table)] of the landmarks with the best bound
+        between start and goal, none while the tables are stale
+        """
+        index = self.graph.index
+        sid = index.get(start, None)
+        gid = index.get(goal, None)
+        if self.stale or sid is None or gid is None or not self.known(sid) or not self.known(gid):
+            return []
+        bounds = []
+        for to_table, from_table in zip(self.to_landmark, self.from_landmark):
+            goal_to = to_table[gid]
+            goal_from = from_table[gid]
+            bound = 0
+            if goal_to < INF and to_table[sid] < INF:
+                bound = to_table[sid] - goal_to
+            if goal_from < INF:
+                bound = max(bound, goal_from - from_table[sid])
+            bounds.append((bound, to_table, from_table))
+        bounds.sort(key=lambda b: b[0], reverse=True)
+        return [b[1:] for b in bounds[:count]]
+
+
+class RouteCache(object):
+    """
+    planned paths keyed by (start, goal) nodes. each path is indexed by
+    the chunk sections (x >> 4, y >> 4, z >> 4) of the blocks its nodes
+    stand on, pass and jump through, a block change drops only the paths
+    through its section. least recently used paths go over the limit.
+    """
+    def __init__(self, limit=config.ROUTE_CACHE):
+        self.limit = limit
+        self.routes = OrderedDict()
+        self.sections = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return "route cache hits %d misses %d hit rate %.0f%% invalidated %d routes %d" % \
+            (self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0,
+             self.invalidated, len(self.routes))
+
+    def route_sections(self, nodes):
+        sections = set()
+        for (x1, y1, z1), (x2, y2, z2) in zip(nodes, nodes[1:]):
+            ys = xrange(max(min(y1, y2) - 1, 0) >> 4, ((max(y1, y2) + 3) >> 4) + 1)
+            # diagonal steps go past the corner columns too
+            for x, z in ((x1, z1), (x2, z2), (x1, z2), (x2, z1)):
+                for sy in ys:
+                    sections.add((x >> 4, sy, z >> 4))
+        return sections
+
+    def get(self, start, goal):
+        """
+        path nodes from goal to start as in pathfinding.Path
+        """
+        key = (start, goal)
+        entry = self.routes.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.routes[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, start, goal, nodes):
+        key = (start, goal)
+        self.discard(key)
+        sections = self.route_sections(nodes)
+        self.routes[key] = (nodes, sections)
+        for section in sections:
+            self.sections[section].add(key)
+        while len(self.routes) > self.limit:
+            self.discard(next(iter(self.routes)))
+
+    def discard(self, key):
+        entry = self.routes.pop(key, None)
+        if entry is None:
+            return
+        for section in entry[1]:
+            keys = self.sections[section]
+            keys.discard(key)
+            if not keys:
+                del self.sections[section]
+
+    def section_change(self, section):
+        keys = self.sections.get(section, None)
+        if keys:
+            self.invalidated += len(keys)
+            for key in list(keys):
+                self.discard(key)
+
+    def block_change(self, x, y, z):
+        self.section_change((x >> 4, y >> 4, z >> 4))
+
+    def chunk_change(self, cx, cz, levels=None):
+        for sy in (xrange(config.WORLD_HEIGHT >> 4) if levels is None else levels):
+            self.section_change((cx, sy, cz))
+
+
+class ChunkSeed(object):
+    """
+    nodes and edges of a whole chunk from block kinds. the chunk column
+    is turned into long integers with one byte per block, so masks of
+    blocks that can or cannot be stood on are computed for all blocks at
+    once. plain full cubes with two clear blocks above are nodes, their
+    edges are decided by the kinds of the blocks the move goes through,
+    the same way GridSpace would. whatever is not plain is left to
+    GridSpace, see NavigationGrid.seed.
+    """
+    def __init__(self, grid, coords, levels):
+        self.grid = grid
+        self.coords = coords
+        ids = bytearray(SEED_LEVEL)
+        for level in levels:
+            ids += level if level is not None else seed_empty_level
+        ids += bytearray(SEED_LEVEL * 3)
+        self.kinds = ids.translate(seed_kinds)
+        bits = SEED_LEVEL * 8
+        solid = long(binascii.hexlify(ids.translate(seed_solid_table)), 16)
+        clear = long(binascii.hexlify(ids.translate(seed_clear_table)), 16)
+        stand = solid & (clear << bits) & (clear << 2 * bits)
+        cannot = (clear & ((clear | solid) >> bits)) | (solid << bits) | (solid & (solid << 2 * bits))
+        cannot &= seed_ones
+        state = (seed_ones - stand - cannot) * 2 + stand
+        self.state = bytearray(binascii.unhexlify('%0*x' % (2 * len(ids), state)))
+
+    def result(self):
+        """
+        (coords, nodes, masks, costs, unresolved), arrays packed to strings
+        so a worker sends back a few strings. nodes and unresolved are
+        positions (y << 8) | (z << 4) | x in the chunk, masks and costs
+        of edges are laid out as in DirectedGraph, costs in slot order
+        """
+        nodes = array('H')
+        masks = []
+        costs = array('f')
+        unresolved = array('H')
+        edge_slots = tools.edge_slots
+        for crd in self.nodes():
+            x, y, z = crd
+            out, resolved = self.edges(x, y, z)
+            slots = sorted((edge_slots[(to[0] - x, to[1] - y, to[2] - z)], cost) for to, cost in out)
+            mask = 0
+            for slot, cost in slots:
+                mask |= 1 << slot
+                costs.append(cost)
+            position = (y << 8) | ((z & 15) << 4) | (x & 15)
+            nodes.append(position)
+            masks.append(mask)
+            if not resolved:
+                unresolved.append(position)
+        return self.coords, nodes.tostring(), tools.pack_masks(masks), costs.tostring(), unresolved.tostring()
+
+    def nodes(self):
+        """
+        coordinates of the blocks that can be stood on
+        """
+        cx = self.coords[0] << 4
+        cz = self.coords[1] << 4
+        out = []
+        find = self.state.find
+        end = SEED_LEVEL * (config.WORLD_HEIGHT + 1)
+        i = find('\x01', SEED_LEVEL)
+        while i != -1 and i < end:
+            out.append((cx + (i & 15), (i >> 8) - 1, cz + ((i >> 4) & 15)))
+            i = find('\x01', i + 1)
+        return out
+
+    def kind(self, x, y, z):
+        if (x >> 4, z >> 4) == self.coords:
+            return self.kinds[((y + 1) << 8) | ((z & 15) << 4) | (x & 15)]
+        return seed_kinds[self.grid.get_block_index(x, y, z) >> 4]
+
+    def state_at(self, x, y, z):
+        if (x >> 4, z >> 4) == self.coords:
+            return self.state[((y + 1) << 8) | ((z & 15) << 4) | (x & 15)]
+        below = self.kind(x, y - 1, z)
+        here = self.kind(x, y, z)
+        up1 = self.kind(x, y + 1, z)
+        up2 = self.kind(x, y + 2, z)
+        if here == SEED_SOLID and up1 == SEED_CLEAR and up2 == SEED_CLEAR:
+            return SEED_STAND
+        if up1 == SEED_SOLID or (here == SEED_CLEAR and below != SEED_OTHER) or \
+                (here == SEED_SOLID and up2 == SEED_SOLID):
+            return SEED_NOT
+        return SEED_UNKNOWN
+
+    def free(self, spans, below=()):
+        """
+        True when the blocks in (x, z, y_from, y_to) spans are all clear,
+        False when one of them is solid, None when it cannot be told.
+        the (x, z, y) blocks in below may be anything plain, a fence or a
+        wall there reaches up into the spans, so they give None
+        """
+        out = True
+        for x, z, y_from, y_to in spans:
+            for y in xrange(y_from, y_to + 1):
+                kind = self.kind(x, y, z)
+                if kind == SEED_SOLID:
+                    return False
+                elif kind == SEED_OTHER:
+                    out = None
+        for x, z, y in below:
+            if self.kind(x, y, z) == SEED_OTHER:
+                out = None
+        return out
+
+    def edges(self, x, y, z):
+        """
+        ([(to, cost)], resolved) for the node at x, y, z, same candidates
+        in the same order as NavigationGrid.do_incomplete_node. resolved is
+        False when some of the moves need GridSpace
+        """
+        if 0 < x & 15 < 15 and 0 < z & 15 < 15:
+            return self.inner_edges(x, y, z)
+        grid = self.grid
+        out = []
+        resolved = True
+        for i, j in tools.adjacency:
+            nx = x + i
+            nz = z + j
+            if not grid.chunk_complete_at((nx >> 4, nz >> 4)):
+                resolved = False
+                continue
+            if i != 0 and j != 0:
+                if not grid.chunk_complete_at((x >> 4, nz >> 4)) or \
+                        not grid.chunk_complete_at((nx >> 4, z >> 4)):
+                    resolved = False
+                    continue
+                corners = ((nx, z), (x, nz))
+            else:
+                corners = ()
+            distance = math.hypot(i, j)
+            for dy in (0, 1, 2, -1, -2, -3):
+                state = self.state_at(nx, y + dy, nz)
+                if state == SEED_NOT:
+                    continue
+                if state == SEED_UNKNOWN:
+                    can = None
+                elif dy == 0:
+                    can = self.free([(cx, cz, y + 1, y + 2) for cx, cz in corners],
+                                    [(cx, cz, y) for cx, cz in corners])
+                elif dy == 1:
+                    can = self.free([(x, z, y + 3, y + 3)] + [(cx, cz, y + 2, y + 3) for cx, cz in corners],
+                                    [(cx, cz, y + 1) for cx, cz in corners])
+                elif dy == 2:
+                    can = False
+                else:
+                    can = self.free([(nx, nz, y + dy + 3, y + 2)] + [(cx, cz, y + 1, y + 2) for cx, cz in corners],
+                                    [(cx, cz, y) for cx, cz in corners])
+                break
+            else:
+                can = False
+            if can is None:
+                resolved = False
+            elif can:
+                cost = config.COST_DIRECT * distance
+                if dy != 0:
+                    cost += config.COST_FALL * distance
+                    cost += config.COST_JUMP
+                out.append(((nx, y + dy, nz), cost))
+        return out, resolved
+
+    def inner_edges(self, x, y, z):
+        """
+        edges for a node with all neighbours in the chunk, straight from
+        the seed arrays
+        """
+        state = self.state
+        kinds = self.kinds
+        base = ((y + 1) << 8) | ((z & 15) << 4) | (x & 15)
+        out = []
+        resolved = True
+        for i, j in tools.adjacency:
+            n = base + (j << 4) + i
+            if i != 0 and j != 0:
+                corners = (base + i, base + (j << 4))
+            else:
+                corners = ()
+            for dy in (0, 1, 2, -1, -2, -3):
+                st = state[n + (dy << 8)]
+                if st == SEED_NOT:
+                    continue
+                if st == SEED_UNKNOWN:
+                    can = None
+                elif dy == 2:
+                    can = False
+                else:
+                    if dy == 0:
+                        spans = [(c, 1, 2) for c in corners]
+                    elif dy == 1:
+                        spans = [(base, 3, 3)] + [(c, 2, 3) for c in corners]
+                    else:
+                        spans = [(n, dy + 3, 2)] + [(c, 1, 2) for c in corners]
+                    can = True
+                    for c, k_from, k_to in spans:
+                        for k in xrange(k_from, k_to + 1):
+                            kind = kinds[c + (k << 8)]
+                            if kind == SEED_SOLID:
+                                can = False
+                                break
+                            elif kind == SEED_OTHER:
+                                can = None
+                        if can is False:
+                            break
+                    if can is not False:
+                        low = 1 if dy == 1 else 0
+                        for c in corners:
+                            if kinds[c + (low << 8)] == SEED_OTHER:
+                                can = None
+                break
+            else:
+                can = False
+            if can is None:
+                resolved = False
+            elif can:
+                distance = math.hypot(i, j)
+                cost = config.COST_DIRECT * distance
+                if dy != 0:
+                    cost += config.COST_FALL * distance
+                    cost += config.COST_JUMP
+                out.append(((x + i, y + dy, z + j), cost))
+        return out, resolved
+
+
+class SnapshotGrid(object):
+    """
+    block ids of a chunk and its neighbours from Grid.snapshot, enough of
+    Grid for ChunkSeed in a worker process
+    """
+    def __init__(self, snapshot):
+        self.chunks = dict((coords, (complete, levels)) for coords, complete, levels in snapshot)
+
+    def levels(self, coords):
+        return self.chunks[coords][1]
+
+    def chunk_complete_at(self, crd):
+        chunk = self.chunks.get(crd, None)
+        return chunk is not None and chunk[0]
+
+    def get_block_index(self, x, y, z):
+        """
+        block id << 4, meta is not in the snapshot
+        """
+        if y > 255 or y < 0:
+            return 0
+        chunk = self.chunks.get((x >> 4, z >> 4), None)
+        if chunk is None:
+            return 0
+        level = chunk[1][y >> 4]
+        if level is None:
+            return 0
+        return ord(level[((y & 15) << 8) | ((z & 15) << 4) | (x & 15)]) << 4
+
+
+def seed_worker_init():
+    """
+    workers give way to the reactor process when they share a cpu
+    """
+    os.nice(10)
+
+
+def seed_snapshot(snapshot):
+    """
+    ChunkSeed.result in a worker process, nodes are None when it failed
+    """
+    coords = snapshot[0][0]
+    try:
+        grid = SnapshotGrid(snapshot)
+        return ChunkSeed(grid, coords, grid.levels(coords)).result()
+    except Exception:
+        return coords, None, traceback.format_exc(), None, None
+
+
+class SeedPool(object):
+    """
+    worker processes running ChunkSeed off the reactor. chunks go out as
+    snapshots of block ids, nodes and edges come back to the navgrid on
+    the reactor thread, see NavigationGrid.seed_done
+    """
+    def __init__(self, processes=config.NAVGRID_WORKERS):
+        self.pool = multiprocessing.Pool(processes, seed_worker_init)
+        self.sent = 0
+        self.returned = 0
+        self.failed = 0
+
+    def __str__(self):
+        return "seed pool sent %d returned %d failed %d" % (self.sent, self.returned, self.failed)
+
+    def submit(self, navgrid, snapshot):
+        def done(result):
+            reactor.callFromThread(self.done, navgrid, result)
+        self.sent += 1
+        self.pool.apply_async(seed_snapshot, (snapshot,), callback=done)
+
+    def done(self, navgrid, result):
+        self.returned += 1
+        if result[1] is None:
+            self.failed += 1
+            log.msg("seed worker failed on chunk %s\n%s" % (result[0], result[2]))
+        navgrid.seed_done(result)
+
+    def close(self):
+        self.pool.terminate()
+
+
+def node_chunk(crd):
+    return (crd[0] >> 4, crd[2] >> 4)
+
+
+def corridor_distance(chunk, a, b):
+    """
+    distance in chunks from chunk to the segment between chunks a and b
+    """
+    ax, az = a
+    dx = b[0] - ax
+    dz = b[1] - az
+    px = chunk[0] - ax
+    pz = chunk[1] - az
+    length = dx * dx + dz * dz
+    t = 0 if length == 0 else max(0.0, min(1.0, (px * dx + pz * dz) / float(length)))
+    return math.hypot(px - t * dx, pz - t * dz)
+
+
+class FocusQueue(object):
+    """
+    navgrid work bucketed by chunk, first in first out inside a chunk.
+    chunks closest to the way from the bot to its travel goal go first,
+    chunks farther than config.NAVGRID_HORIZON from it are parked until
+    the focus comes near or they are unparked for the current goal. true
+    while there is work that is not parked. chunk_of maps a key to its
+    chunk, keys are chunks when it is None
+    """
+    def __init__(self, chunk_of=None):
+        self.chunk_of = chunk_of
+        self.horizon = config.NAVGRID_HORIZON
+        self.chunks = {}
+        self.order = {}
+        self.heap = []
+        self.parked = set()
+        self.bot = None
+        self.goal = None
+        self.serial = 0
+        self.ready = 0
+        self.waiting = 0
+        self.done = 0
+        self.waited = 0.0
+
+    def __str__(self):
+        return "queue ready %d parked %d chunks %d oldest %.1fs done %d average wait %.0fms" % \
+            (self.ready, self.waiting, len(self.chunks), self.oldest,
+             self.done, 1000 * self.waited / self.done if self.done else 0)
+
+    def __nonzero__(self):
+        return self.ready > 0
+
+    def __len__(self):
+        return self.ready + self.waiting
+
+    def __contains__(self, key):
+        bucket = self.chunks.get(self.chunk(key))
+        return bucket is not None and key in bucket
+
+    def __iter__(self):
+        for bucket in self.chunks.values():
+            for key in bucket.keys():
+                yield key
+
+    @property
+    def oldest(self):
+        now = time.time()
+        return max([now - bucket[next(iter(bucket))][1] for chunk, bucket in self.chunks.iteritems()
+                    if bucket and chunk not in self.parked] or [0])
+
+    def chunk(self, key):
+        return key if self.chunk_of is None else self.chunk_of(key)
+
+    def has_chunk(self, chunk):
+        """
+        there are keys of chunk, parked or not
+        """
+        return bool(self.chunks.get(chunk))
+
+    def priority(self, chunk):
+        if self.bot is None:
+            return 0
+        return corridor_distance(chunk, self.bot, self.bot if self.goal is None else self.goal)
+
+    def add(self, key, value):
+        chunk = self.chunk(key)
+        bucket = self.chunks.get(chunk)
+        if bucket is None:
+            bucket = self.chunks[chunk] = OrderedDict()
+            self.order[chunk] = self.serial
+            self.serial += 1
+            priority = self.priority(chunk)
+            if self.horizon is not None and priority > self.horizon:
+                self.parked.add(chunk)
+            else:
+                heapq.heappush(self.heap, (priority, self.order[chunk], chunk))
+        old = bucket.get(key)
+        if old is None:
+            bucket[key] = (value, time.time())
+            if chunk in self.parked:
+                self.waiting += 1
+            else:
+                self.ready += 1
+        else:
+            bucket[key] = (value or old[0], old[1])
+
+    def pop(self):
+        """
+        the oldest key of the nearest chunk and its value
+        """
+        while True:
+            chunk = self.heap[0][2]
+            bucket = self.chunks[chunk]
+            if bucket:
+                break
+            heapq.heappop(self.heap)
+            del self.chunks[chunk]
+            del self.order[chunk]
+        key, (value, queued) = bucket.popitem(last=False)
+        self.ready -= 1
+        self.done += 1
+        self.waited += time.time() - queued
+        return key, value
+
+    def discard(self, key):
+        chunk = self.chunk(key)
+        bucket = self.chunks.get(chunk)
+        if bucket is not None and key in bucket:
+            del bucket[key]
+            if chunk in self.parked:
+                self.waiting -= 1
+            else:
+                self.ready -= 1
+
+    def discard_chunk(self, chunk):
+        bucket = self.chunks.get(chunk)
+        if bucket:
+            if chunk in self.parked:
+                self.waiting -= len(bucket)
+            else:
+                self.ready -= len(bucket)
+            bucket.clear()
+
+    def focus(self, bot, goal):
+        """
+        order the chunks again for the bot and goal chunks, goal can be None
+        """
+        if (bot, goal) == (self.bot, self.goal):
+            return
+        if goal != self.goal:
+            self.horizon = config.NAVGRID_HORIZON
+        self.bot = bot
+        self.goal = goal
+        self.reorder()
+
+    def unpark(self):
+        """
+        parked chunks are taken in too until the goal changes, true when
+        there were any
+        """
+        parked = self.waiting > 0
+        self.horizon = None
+        if parked:
+            self.reorder()
+        return parked
+
+    def reorder(self):
+        for chunk in [chunk for chunk, bucket in self.chunks.iteritems() if not bucket]:
+            del self.chunks[chunk]
+            del self.order[chunk]
+        self.heap = []
+        self.parked = set()
+        self.ready = 0
+        self.waiting = 0
+        for chunk, bucket in self.chunks.iteritems():
+            priority = self.priority(chunk)
+            if self.horizon is not None and priority > self.horizon:
+                self.parked.add(chunk)
+                self.waiting += len(bucket)
+            else:
+                self.heap.append((priority, self.order[chunk], chunk))
+                self.ready += len(bucket)
+        heapq.heapify(self.heap)
 
 
 class NavigationGrid(object):
     def __init__(self, world):
         self.world = world
-        self.incomplete_nodes = OrderedDict()
+        self.incomplete_nodes = FocusQueue(node_chunk)
+        self.seed_queue = FocusQueue()
+        self.seed_results = deque()
+        self.seed_inflight = set()
+        self.seed_dirty = set()
+        self.seed_waiting = defaultdict(OrderedDict)
         self.graph = tools.DirectedGraph()
         self.chunk_borders = ChunkBorders()
         self.sign_waypoints = SignWayPoints(self)
+        self.chunk_graph = ChunkGraph(self.graph)
+        self.areas = NavigationAreas(self.graph)
+        self.landmarks = Landmarks(self)
+        self.route_cache = RouteCache()
+        self.planners = weakref.WeakSet()
+        self.focus_bot = None
+        self.focus_goal = None
 
     def check_node_resources(self, crd):
         pass
 
+    def node_changed(self, crd):
+        """
+        edges of crd were added, removed or changed cost
+        """
+        self.chunk_graph.changed(crd)
+        self.landmarks.changed()
+        for planner in self.planners:
+            planner.node_changed(crd)
+
     def compute(self, node, recheck=False):
-        if self.incomplete_nodes:
-            self.incomplete_nodes[node] = recheck
+        if self.incomplete_nodes or self.seed_queue or self.seed_results:
+            self.incomplete_nodes.add(node, recheck)
         else:
-            self.incomplete_nodes[node] = recheck
-            cootask = cooperate(self.do_incomplete_nodes())
+            self.incomplete_nodes.add(node, recheck)
+            if not self.incomplete_nodes:
+                return
+            cootask = tools.cooperate(self.do_incomplete_nodes())
+            d = cootask.whenDone()
+            d.addErrback(logbot.exit_on_error)
+
+    def seed_chunk(self, coords):
+        """
+        add the plain nodes of a complete chunk in one go, before the
+        incomplete nodes are done
+        """
+        if self.incomplete_nodes or self.seed_queue or self.seed_results:
+            self.seed_queue.add(coords, True)
+        else:
+            self.seed_queue.add(coords, True)
+            if not self.seed_queue:
+                return
+            cootask = tools.cooperate(self.do_incomplete_nodes())
+            d = cootask.whenDone()
+            d.addErrback(logbot.exit_on_error)
+
+    @property
+    def building(self):
+        """
+        work near the bot or its goal is not done yet
+        """
+        return bool(self.incomplete_nodes or self.seed_queue or self.seed_results or self.seed_inflight)
+
+    def focus(self, bot=None, goal=None):
+        """
+        navgrid work is done nearest to the way from the bot to the goal
+        first, bot and goal are block coords, None keeps the current one
+        """
+        if bot is not None:
+            self.focus_bot = node_chunk(bot)
+        if goal is not None:
+            self.focus_goal = node_chunk(goal)
+        busy = self.incomplete_nodes or self.seed_queue or self.seed_results
+        self.incomplete_nodes.focus(self.focus_bot, self.focus_goal)
+        self.seed_queue.focus(self.focus_bot, self.focus_goal)
+        if not busy and (self.incomplete_nodes or self.seed_queue):
+            cootask = tools.cooperate(self.do_incomplete_nodes())
+            d = cootask.whenDone()
+            d.addErrback(logbot.exit_on_error)
+
+    def clear_goal(self):
+        """
+        travel is over, work is ordered around the bot alone
+        """
+        self.focus_goal = None
+        self.incomplete_nodes.focus(self.focus_bot, None)
+        self.seed_queue.focus(self.focus_bot, None)
+
+    def unpark(self):
+        """
+        do the work parked beyond the horizon as well, for as long as the
+        goal stays. true when there was such work
+        """
+        busy = self.incomplete_nodes or self.seed_queue or self.seed_results
+        parked = self.incomplete_nodes.unpark()
+        parked = self.seed_queue.unpark() or parked
+        if not busy and (self.incomplete_nodes or self.seed_queue):
+            cootask = tools.cooperate(self.do_incomplete_nodes())
             d = cootask.whenDone()
             d.addErrback(logbot.exit_on_error)
+        return parked
+
+    def seed_changed(self, chunk):
+        """
+        blocks in chunk changed, seeds of it and its neighbours that are
+        not applied yet are done again
+        """
+        for i, j in [(0, 0)] + tools.adjacency:
+            c = (chunk[0] + i, chunk[1] + j)
+            if c in self.seed_inflight:
+                self.seed_dirty.add(c)
 
     def do_incomplete_nodes(self):
-        while self.incomplete_nodes:
-            crd, recheck = self.incomplete_nodes.popitem(last=False)
-            self.do_incomplete_node(crd, recheck)
-            self.check_node_resources(crd)
+        while self.seed_queue or self.seed_results or self.incomplete_nodes:
+            if self.seed_results:
+                for _ in self.apply_seed(*self.seed_results.popleft()):
+                    yield None
+                continue
+            if self.seed_queue:
+                coords, _ = self.seed_queue.pop()
+                self.seed(coords)
+            else:
+                crd, recheck = self.incomplete_nodes.pop()
+                chunk = node_chunk(crd)
+                if chunk in self.seed_inflight:
+                    # wait for the seed, most likely it has the node already
+                    self.seed_waiting[chunk][crd] = recheck
+                    continue
+                self.do_incomplete_node(crd, recheck)
+                self.check_node_resources(crd)
+            yield None
+
+    def seed_finished(self, coords):
+        """
+        nodes that waited for the seed of chunk at coords are done now
+        """
+        self.seed_inflight.discard(coords)
+        for crd, recheck in self.seed_waiting.pop(coords, {}).iteritems():
+            self.compute(crd, recheck)
+
+    def seed(self, coords):
+        """
+        run ChunkSeed on the chunk, in the seed pool if the world has one
+        """
+        chunk = self.world.grid.get_chunk(coords)
+        if chunk is None or not chunk.complete:
+            return
+        self.seed_dirty.discard(coords)
+        self.seed_inflight.add(coords)
+        if self.world.seed_pool is None:
+            self.seed_results.append(ChunkSeed(self.world.grid, coords, chunk.blocks).result())
+        else:
+            self.world.seed_pool.submit(self, self.world.grid.snapshot(coords))
+
+    def seed_done(self, result):
+        """
+        result of seed_snapshot from the seed pool
+        """
+        coords = result[0]
+        if result[1] is None:
+            chunk = self.world.grid.get_chunk(coords)
+            if chunk is None or not chunk.complete:
+                self.seed_finished(coords)
+                return
+            result = ChunkSeed(self.world.grid, coords, chunk.blocks).result()
+        if self.incomplete_nodes or self.seed_queue or self.seed_results:
+            self.seed_results.append(result)
+        else:
+            self.seed_results.append(result)
+            cootask = tools.cooperate(self.do_incomplete_nodes())
+            d = cootask.whenDone()
+            d.addErrback(logbot.exit_on_error)
+
+    def apply_seed(self, coords, nodes, masks, costs, unresolved):
+        """
+        add seeded nodes and edges, config.NAVGRID_APPLY_BATCH nodes a step.
+        nodes with moves ChunkSeed could not tell go to incomplete nodes,
+        a chunk that changed since it was seeded is seeded again
+        """
+        grid = self.world.grid
+        graph = self.graph
+        edge_offsets = tools.edge_offsets
+        cx = coords[0] << 4
+        cz = coords[1] << 4
+        nodes = [(cx + (p & 15), p >> 8, cz + ((p >> 4) & 15)) for p in array('H', nodes)]
+        masks = tools.unpack_masks(masks)
+        costs = array('f', costs)
+        k = 0
+        for start in xrange(0, len(nodes), config.NAVGRID_APPLY_BATCH):
+            if coords in self.seed_dirty or not grid.chunk_complete_at(coords):
+                self.seed_finished(coords)
+                if coords in self.seed_dirty:
+                    self.seed_chunk(coords)
+                return
+            end = min(start + config.NAVGRID_APPLY_BATCH, len(nodes))
+            for n in xrange(start, end):
+                graph.add_node(nodes[n], miny=nodes[n][1] + 1.0)
+            for n in xrange(start, end):
+                crd = nodes[n]
+                x, y, z = crd
+                mask = masks[n]
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    dx, dy, dz = edge_offsets[bit.bit_length() - 1]
+                    to = (x + dx, y + dy, z + dz)
+                    cost = costs[k]
+                    k += 1
+                    if not graph.has_node(to):
+                        to_chunk = (to[0] >> 4, to[2] >> 4)
+                        if not grid.chunk_complete_at(to_chunk):
+                            self.compute(crd)
+                            continue
+                        graph.add_node(to, miny=to[1] + 1.0)
+                        if to_chunk != coords and to_chunk not in self.seed_queue and \
+                                to_chunk not in self.seed_inflight:
+                            self.compute(to)
+                    graph.add_edge(crd, to, cost)
+                    self.areas.union(crd, to)
             yield None
+        self.seed_finished(coords)
+        for p in array('H', unresolved):
+            self.compute((cx + (p & 15), p >> 8, cz + ((p >> 4) & 15)))
+        self.chunk_graph.chunk_changed(coords)
+        for i, j in tools.adjacency:
+            self.chunk_graph.chunk_changed((coords[0] + i, coords[1] + j))
+        self.landmarks.changed()
+        for planner in self.planners:
+            for crd in nodes:
+                planner.node_changed(crd)
 
     def do_incomplete_node(self, crd, recheck):
         center_space = GridSpace(self.world.grid, coords=crd)
@@ -137,10 +1479,19 @@ class NavigationGrid(object):
             self.graph.add_node(
                 possible_space.coords, miny=possible_space.bb_stand.min_y)
         if center_space.can_go(possible_space):
+            changed = not self.graph.has_edge(center_space.coords, possible_space.coords) or \
+                abs(self.graph.get_edge(center_space.coords, possible_space.coords) - center_space.edge_cost) > 0.001
             self.graph.add_edge(center_space.coords, possible_space.coords,
                                 center_space.edge_cost)
-        else:
+            if changed:
+                self.areas.union(center_space.coords, possible_space.coords)
+                self.node_changed(center_space.coords)
+                self.node_changed(possible_space.coords)
+        elif self.graph.has_edge(center_space.coords, possible_space.coords):
             self.graph.remove_edge(center_space.coords, possible_space.coords)
+            self.areas.edge_removed(center_space.coords, possible_space.coords)
+            self.node_changed(center_space.coords)
+            self.node_changed(possible_space.coords)
 
     def check_path(self, path):
         if path is None:
@@ -157,6 +1508,9 @@ class NavigationGrid(object):
             if last_one is not None:
                 if not last_one.can_go(gs):
                     self.graph.remove_edge(last_one.coords, gs.coords)
+                    self.areas.edge_removed(last_one.coords, gs.coords)
+                    self.node_changed(last_one.coords)
+                    self.node_changed(gs.coords)
                     ok = False
             last_one = gs
         return ok
@@ -164,13 +1518,59 @@ class NavigationGrid(object):
     def delete_node(self, crd):
         if self.graph.has_node(crd):
             affected = self.graph.remove_node(crd)
+            self.areas.remove_node(crd, affected)
+            self.node_changed(crd)
             for aff in affected:
+                self.node_changed(aff)
                 self.compute(aff)
             self.chunk_borders.remove(crd)
-        try:
-            del self.incomplete_nodes[crd]
-        except KeyError:
-            pass
+        self.incomplete_nodes.discard(crd)
+
+    @property
+    def memory_size(self):
+        return self.graph.memory_size + self.landmarks.memory_size
+
+    def evict_chunks(self, chunks):
+        """
+        drop nodes, incomplete nodes and border records in chunks already
+        removed from the grid. nodes next to them are computed again and
+        their edges into the chunks become border records.
+        """
+        evicted = [crd for crd in self.graph if (crd[0] >> 4, crd[2] >> 4) in chunks]
+        affected = set()
+        for crd in evicted:
+            affected.update(self.graph.remove_node(crd))
+            self.areas.remove_node(crd)
+        for chunk in chunks:
+            self.incomplete_nodes.discard_chunk(chunk)
+            self.seed_queue.discard(chunk)
+            self.chunk_borders.remove_chunk(chunk)
+            self.chunk_graph.chunk_changed(chunk)
+        for planner in self.planners:
+            for crd in evicted:
+                planner.node_changed(crd)
+        for crd in affected:
+            if (crd[0] >> 4, crd[2] >> 4) not in chunks:
+                self.node_changed(crd)
+                self.compute(crd)
+        return len(evicted)
+
+    def reachable(self, crd, start=None):
+        """
+        False when crd is not a node or is in another area than start,
+        start defaults to the node the bot stands on
+        """
+        if not self.graph.has_node(crd):
+            return False
+        if start is None:
+            bot = self.world.bot
+            block = bot.standing_on_block(bot.bot_object)
+            if block is None:
+                return True
+            start = block.coords
+        if not self.graph.has_node(start):
+            return True
+        return self.areas.same_area(start, crd)
 
     def insert_node(self, coords, gspace):
         if self.graph.has_node(coords):
@@ -185,15 +1585,23 @@ class NavigationGrid(object):
             self.chunk_borders.remove(crd)
 
     def block_change(self, old_block, new_block):
-        coords = new_block.coords
-        gs = GridSpace(self.world.grid, coords=coords)
-        if gs.can_stand_on:
-            self.insert_node(gs.coords, gspace=gs)
-        else:
-            self.delete_node(gs.coords)
-        for i in [-2, -1, 1, 2]:
-            crd = (coords[0], coords[1] - i, coords[2])
-            gs = GridSpace(self.world.grid, crd)
+        self.blocks_change([new_block.coords])
+
+    def blocks_change(self, changed):
+        """
+        blocks at changed coords are new, every node they can make or
+        break is looked at once however many of them are under or over it
+        """
+        chunks = set()
+        columns = set()
+        for x, y, z in changed:
+            chunks.add((x >> 4, z >> 4))
+            for i in xrange(-2, 3):
+                columns.add((x, y + i, z))
+        for chunk in chunks:
+            self.seed_changed(chunk)
+        for crd in sorted(columns):
+            gs = GridSpace(self.world.grid, coords=crd)
             if gs.can_stand_on:
                 self.insert_node(gs.coords, gspace=gs)
             else:
@@ -0,0 +1,235 @@
+
+import os
+import mmap
+import struct
+from array import array
+from collections import defaultdict
+
+import tools
+import logbot
+
+
+log = logbot.getlogger("NAVSNAPSHOT")
+
+
+SNAPSHOT_HEADER = struct.Struct("<4sII")
+SNAPSHOT_MAGIC = "TBG2"
+CHUNK_HEADER = struct.Struct("<ii16sIIII")
+BORDER_FIELDS = 5  # chunk diff and coords of one ChunkBorders record
+
+
+def snapshot_path(cache_path):
+    return os.path.splitext(cache_path)[0] + ".navgrid"
+
+
+def chunk_settled(navgrid, coords):
+    """
+    no navgrid work is waiting in the chunk
+    """
+    return coords not in navgrid.seed_queue and coords not in navgrid.seed_inflight and \
+        not navgrid.seed_waiting.get(coords) and not navgrid.incomplete_nodes.has_chunk(coords)
+
+
+def save_snapshot(navgrid, grid, path):
+    """
+    write nodes, edges, areas, border records and waypoint signs of
+    complete and settled chunks of grid to path. per chunk a header with
+    the chunk digest and counts, then node positions in the chunk, node
+    miny, successor and predecessor masks, area labels, edge costs in
+    mask order, border records and sign lines.
+    """
+    graph = navgrid.graph
+    areas = navgrid.areas
+    by_chunk = {}
+    for crd, nid in graph.index.iteritems():
+        by_chunk.setdefault((crd[0] >> 4, crd[2] >> 4), []).append((crd, nid))
+    signs = {}
+    for sign in navgrid.sign_waypoints.crd_to_sign.itervalues():
+        signs.setdefault((sign.coords[0] >> 4, sign.coords[2] >> 4), []).append(sign)
+    records = []
+    for coords, chunk in grid.chunks.iteritems():
+        if not chunk.complete or not chunk_settled(navgrid, coords):
+            continue
+        nodes = by_chunk.get(coords, [])
+        nodes.sort()
+        positions = array('H', [(y << 8) | ((z & 15) << 4) | (x & 15) for (x, y, z), _ in nodes])
+        miny = array('f', [graph.miny[nid] for _, nid in nodes])
+        succ = tools.pack_masks([graph.succ[nid] for _, nid in nodes])
+        pred = tools.pack_masks([graph.pred[nid] for _, nid in nodes])
+        labels = array('I')
+        for crd, _ in nodes:
+            area = areas.area_id(crd)
+            labels.append(area << 1 | (area in areas.dirty))
+        costs = array('f')
+        for _, nid in nodes:
+            mask = graph.succ[nid]
+            base = nid * tools.EDGE_SLOTS
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                costs.append(graph.costs[base + bit.bit_length() - 1])
+        borders = array('i')
+        for diff, crds in navgrid.chunk_borders.borders.get(coords, {}).iteritems():
+            for crd in crds:
+                borders.extend((diff[0], diff[1]) + crd)
+        lines = []
+        for sign in signs.get(coords, []):
+            lines.extend(str(c) for c in sign.coords)
+            lines.extend(line.encode("utf-8") for line in (sign.line1, sign.line2, sign.line3, sign.line4))
+        lines = "\0".join(lines)
+        records.append(CHUNK_HEADER.pack(coords[0], coords[1], chunk.digest(), len(nodes), len(costs),
+                                         len(borders) / BORDER_FIELDS, len(lines)))
+        records.append(positions.tostring() + miny.tostring() + succ + pred +
+                       "".join(arr.tostring() for arr in (labels, costs, borders)))
+        records.append(lines)
+    with open(path + ".tmp", "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, tools.EDGE_SLOTS, len(records) / 3))
+        for record in records:
+            f.write(record)
+    os.rename(path + ".tmp", path)
+    log.msg("navgrid snapshot %s with %d chunks %d nodes" % (path, len(records) / 3, graph.node_count))
+
+
+class NavigationSnapshot(object):
+    """
+    snapshot written by save_snapshot, mapped read only. chunks whose
+    digest is the one of the chunk in the grid are put back into the
+    navgrid as they were, other chunks are left for the seeding.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.chunks = {}
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slots, count = SNAPSHOT_HEADER.unpack_from(self.map, 0)
+        if magic != SNAPSHOT_MAGIC or slots != tools.EDGE_SLOTS:
+            raise ValueError("navgrid snapshot %s has a different format" % path)
+        offset = SNAPSHOT_HEADER.size
+        for _ in xrange(count):
+            x, z, digest, nodes, edges, borders, lines = CHUNK_HEADER.unpack_from(self.map, offset)
+            offset += CHUNK_HEADER.size
+            self.chunks[(x, z)] = (offset, digest, nodes, edges, borders, lines)
+            offset += nodes * (2 + 4 + 2 * 8 + 4) + edges * 4 + borders * BORDER_FIELDS * 4 + lines
+
+    @classmethod
+    def open(cls, path):
+        """
+        the snapshot at path or None when there is none to use
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls(path)
+        except (ValueError, struct.error, EnvironmentError) as e:
+            log.msg("cannot use navgrid snapshot: %s" % e)
+            return None
+
+    def read(self, offset, typecode, count):
+        out = array(typecode)
+        end = offset + count * out.itemsize
+        out.fromstring(self.map[offset:end])
+        return out, end
+
+    def restore(self, navgrid, chunks):
+        """
+        put the snapshot of chunks with the same digest back into navgrid,
+        returns the restored chunk coords. edges to chunks that are not
+        restored are left out, nodes next to them are computed again and
+        their areas are marked dirty.
+        """
+        grid = navgrid.world.grid
+        graph = navgrid.graph
+        restored = {}
+        for coords in chunks:
+            record = self.chunks.get(coords, None)
+            chunk = grid.get_chunk(coords)
+            if record is None or chunk is None or not chunk.complete or record[1] != chunk.digest():
+                continue
+            offset, _, nodes, edges, borders, lines = record
+            cx = coords[0] << 4
+            cz = coords[1] << 4
+            positions, offset = self.read(offset, 'H', nodes)
+            miny, offset = self.read(offset, 'f', nodes)
+            crds = [(cx + (p & 15), p >> 8, cz + ((p >> 4) & 15)) for p in positions]
+            for n in xrange(nodes):
+                graph.add_node(crds[n], miny=miny[n])
+            restored[coords] = (crds, offset, edges, borders, lines)
+        members = defaultdict(list)
+        dirty = set()
+        for coords, (crds, offset, edges, borders, lines) in restored.iteritems():
+            succ = tools.unpack_masks(self.map[offset:offset + 8 * len(crds)])
+            offset += 8 * len(crds)
+            pred = tools.unpack_masks(self.map[offset:offset + 8 * len(crds)])
+            offset += 8 * len(crds)
+            labels, offset = self.read(offset, 'I', len(crds))
+            costs, offset = self.read(offset, 'f', edges)
+            surrounded = all((coords[0] + i, coords[1] + j) in restored for i, j in tools.adjacency)
+            k = 0
+            for n in xrange(len(crds)):
+                crd = crds[n]
+                count = bin(succ[n]).count("1")
+                members[labels[n]].append(crd)
+                x, z = crd[0], crd[2]
+                if surrounded or ((x + 1) & 15 > 1 and (z + 1) & 15 > 1) or \
+                        all(((x + i) >> 4, (z + j) >> 4) in restored for i, j in tools.adjacency):
+                    graph.set_edges(crd, succ[n], pred[n], costs[k:k + count])
+                else:
+                    kept_succ, kept_costs = self.kept(restored, crd, succ[n], costs[k:k + count])
+                    kept_pred, _ = self.kept(restored, crd, pred[n])
+                    graph.set_edges(crd, kept_succ, kept_pred, kept_costs)
+                    if (kept_succ, kept_pred) != (succ[n], pred[n]):
+                        dirty.add(labels[n])
+                    navgrid.compute(crd)
+                k += count
+            records, offset = self.read(offset, 'i', borders * BORDER_FIELDS)
+            for r in xrange(0, len(records), BORDER_FIELDS):
+                to = tuple(records[r + 2:r + 5])
+                if not grid.chunk_complete_at((to[0] >> 4, to[2] >> 4)):
+                    navgrid.chunk_borders.borders[coords][(records[r], records[r + 1])].add(to)
+            if lines:
+                fields = [field.decode("utf-8") for field in self.map[offset:offset + lines].split("\0")]
+                for s in xrange(0, len(fields), 7):
+                    sign = tools.Sign(tuple(int(c) for c in fields[s:s + 3]), *fields[s + 3:s + 7])
+                    if grid.get_block_type(*sign.coords).is_sign:
+                        navgrid.sign_waypoints.new(sign)
+        for label, crds in members.iteritems():
+            navgrid.areas.restore(crds, label & 1 or label in dirty)
+        for coords in restored:
+            navgrid.chunk_graph.chunk_changed(coords)
+            for i, j in tools.adjacency:
+                c = (coords[0] + i, coords[1] + j)
+                navgrid.chunk_graph.chunk_changed(c)
+                if c in grid.chunks and c not in restored:
+                    navgrid.incomplete_on_chunk_border(c, coords)
+        if restored:
+            navgrid.landmarks.changed()
+            for planner in navgrid.planners:
+                for crds, _, _, _, _ in restored.itervalues():
+                    for crd in crds:
+                        planner.node_changed(crd)
+        return set(restored)
+
+    def kept(self, restored, crd, mask, costs=None):
+        """
+        the part of an edge mask of crd, and the costs, that goes to nodes
+        in restored chunks. moves across a chunk corner need all four.
+        """
+        x, y, z = crd
+        kept = 0
+        kept_costs = []
+        k = 0
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            dx, dy, dz = tools.edge_offsets[bit.bit_length() - 1]
+            if ((x + dx) >> 4, (z + dz) >> 4) in restored and ((x + dx) >> 4, z >> 4) in restored and \
+                    (x >> 4, (z + dz) >> 4) in restored:
+                kept |= bit
+                if costs is not None:
+                    kept_costs.append(costs[k])
+            k += 1
+        return kept, kept_costs
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -1,9 +1,11 @@
 ﻿
 # original version from https://github.com/MostAwesomeDude/bravo
 
+import struct
+import cStringIO
 from StringIO import StringIO
 
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 from codecs import register
 from codecs import (BufferedIncrementalDecoder, CodecInfo, IncrementalEncoder,
                     StreamReader, StreamWriter, utf_16_be_encode,
@@ -19,6 +21,7 @@ from construct import SBInt8, SBInt16, SBInt32, SBInt64
 from construct import BFloat32, BFloat64
 from construct import BitStruct, BitField
 from construct import StringAdapter, LengthValueAdapter, Sequence
+from construct import ConstructError, ListContainer
 
 from pynbt import NBTFile
 
@@ -106,10 +109,14 @@ def ByteString(name, size_name, encoding=None):
                          encoding=encoding)
 
 
+def parse_nbt(data):
+    return NBTFile(StringIO(data), compression=NBTFile.Compression.GZIP)
+
+
 class NBTAdapter(Adapter):
 
     def _decode(self, obj, context):
-        return NBTFile(StringIO(obj), compression=NBTFile.Compression.GZIP)
+        return parse_nbt(obj)
 
 
 def NBTdata(name, size_name):
@@ -696,6 +703,593 @@ packet_stream = Struct("packet_stream",
                        )
 
 
+class PacketIncomplete(Exception):
+    """
+    Raised by the fast decoders when the buffer ends before the packet does.
+    need is the buffer length that has to be reached before it makes sense
+    to try decoding the packet again.
+    """
+    def __init__(self, need=0):
+        super(PacketIncomplete, self).__init__(need)
+        self.need = need
+
+
+class PacketError(Exception):
+    """
+    Raised by the fast decoders on bytes that cannot be a packet.
+    """
+
+
+# Fast path decoders.
+# Each reader takes (buffer, offset, fields) where fields is a dict that is
+# turned into Container once the whole packet is read. Reader returns new
+# offset. Produces the same Containers as the construct definitions above.
+
+def _check(buf, end):
+    if end > len(buf):
+        raise PacketIncomplete(end)
+    return end
+
+
+_ubyte = struct.Struct(">B")
+_ushort = struct.Struct(">H")
+_sshort = struct.Struct(">h")
+_uint = struct.Struct(">I")
+_metadata_values = {
+    0: struct.Struct(">b"),
+    1: struct.Struct(">h"),
+    2: struct.Struct(">i"),
+    3: struct.Struct(">f"),
+}
+_int_tup = struct.Struct(">iii")
+_short_tup_rest = struct.Struct(">bh")
+_slot_info = struct.Struct(">BHh")
+
+
+def read_fields(fmt, *names):
+    unpacker = struct.Struct(fmt)
+    unpack_from = unpacker.unpack_from
+    size = unpacker.size
+
+    def read(buf, offset, fields):
+        end = _check(buf, offset + size)
+        fields.update(zip(names, unpack_from(buf, offset)))
+        return end
+    return read
+
+
+def read_struct(name, *readers):
+    def read(buf, offset, fields):
+        inner = {}
+        for reader in readers:
+            offset = reader(buf, offset, inner)
+        fields[name] = Container(**inner)
+        return offset
+    return read
+
+
+def _string16(buf, offset):
+    end = _check(buf, offset + 2)
+    length = _ushort.unpack_from(buf, offset)[0] * 2
+    offset = end
+    end = _check(buf, offset + length)
+    # like the construct strings, a cut surrogate pair at the end is dropped
+    return utf_16_be_decode(str(buf[offset:end]), "strict", False)[0], end
+
+
+def read_string(name):
+    def read(buf, offset, fields):
+        fields[name], offset = _string16(buf, offset)
+        return offset
+    return read
+
+
+def read_bytes(name, size_name):
+    def read(buf, offset, fields):
+        if fields[size_name] < 0:
+            raise PacketError("negative %s %d" % (size_name, fields[size_name]))
+        end = _check(buf, offset + fields[size_name])
+        fields[name] = str(buf[offset:end])
+        return end
+    return read
+
+
+def _slotdata(buf, offset):
+    end = _check(buf, offset + 2)
+    item_id = _sshort.unpack_from(buf, offset)[0]
+    if item_id < 0:
+        return Container(id=item_id), end
+    offset = end
+    end = _check(buf, offset + _slot_info.size)
+    count, damage, size = _slot_info.unpack_from(buf, offset)
+    data = None
+    if size >= 0:
+        offset = end
+        end = _check(buf, offset + size)
+        data = parse_nbt(str(buf[offset:end]))
+    return Container(id=item_id, count=count, damage=damage, size=size, data=data), end
+
+
+def read_slotdata(name="slotdata"):
+    def read(buf, offset, fields):
+        fields[name], offset = _slotdata(buf, offset)
+        return offset
+    return read
+
+
+def _metadata(buf, offset):
+    d = {}
+    while True:
+        offset = _check(buf, offset + 1)
+        key = _ubyte.unpack_from(buf, offset - 1)[0]
+        if key == 0x7f:
+            return d, offset
+        mtype = key >> 5
+        if mtype in _metadata_values:
+            unpacker = _metadata_values[mtype]
+            end = _check(buf, offset + unpacker.size)
+            value = unpacker.unpack_from(buf, offset)[0]
+        elif mtype == 4:
+            value, end = _string16(buf, offset)
+        elif mtype == 5:
+            end = _check(buf, offset + 2)
+            primary = _sshort.unpack_from(buf, offset)[0]
+            if primary != -1:
+                offset = end
+                end = _check(buf, offset + _short_tup_rest.size)
+                count, secondary = _short_tup_rest.unpack_from(buf, offset)
+                value = Container(primary=primary, count=count, secondary=secondary)
+            else:
+                value = Container(primary=primary)
+        elif mtype == 6:
+            end = _check(buf, offset + _int_tup.size)
+            x, y, z = _int_tup.unpack_from(buf, offset)
+            value = Container(x=x, y=y, z=z)
+        else:
+            raise PacketIncomplete(len(buf) + 1)
+        d[key & 0x1f] = Metadata(metadata_types[mtype], value)
+        offset = end
+
+
+def read_metadata(name="metadata"):
+    def read(buf, offset, fields):
+        fields[name], offset = _metadata(buf, offset)
+        return offset
+    return read
+
+
+def read_array(name, count_name, item):
+    """
+    item is a function (buf, offset) -> (value, new offset)
+    """
+    def read(buf, offset, fields):
+        out = ListContainer()
+        for _ in xrange(fields[count_name]):
+            value, offset = item(buf, offset)
+            out.append(value)
+        fields[name] = out
+        return offset
+    return read
+
+
+def array_item(fmt, *names):
+    unpacker = struct.Struct(fmt)
+    unpack_from = unpacker.unpack_from
+    size = unpacker.size
+    if names:
+        def item(buf, offset):
+            end = _check(buf, offset + size)
+            return Container(**dict(zip(names, unpack_from(buf, offset)))), end
+    else:
+        def item(buf, offset):
+            end = _check(buf, offset + size)
+            return unpack_from(buf, offset)[0], end
+    return item
+
+
+def _block_record(buf, offset):
+    end = _check(buf, offset + 4)
+    v = _uint.unpack_from(buf, offset)[0]
+    return Container(x=v >> 28, z=(v >> 24) & 15, y=(v >> 16) & 255,
+                     block_id=(v >> 4) & 4095, meta=v & 15), end
+
+
+def read_if(predicate, reader, name):
+    def read(buf, offset, fields):
+        if predicate(fields):
+            return reader(buf, offset, fields)
+        fields[name] = None
+        return offset
+    return read
+
+
+def read_abilities(buf, offset, fields):
+    offset = read_fields(">B", "flags")(buf, offset, fields)
+    flags = fields["flags"]
+    fields["is_god"] = flags & 1
+    fields["is_flying"] = flags & 2
+    fields["can_fly"] = flags & 4
+    fields["is_creative"] = flags & 8
+    return offset
+
+
+def read_nbt(name, size_name):
+    def read(buf, offset, fields):
+        end = _check(buf, offset + fields[size_name])
+        fields[name] = parse_nbt(str(buf[offset:end]))
+        return end
+    return read
+
+
+class LazyField(object):
+    """
+    Raw bytes of a payload field that are decoded only when touched.
+    Behaves like the decoded value for item and attribute access.
+    """
+    __slots__ = ('raw', 'decoder', 'decoded')
+
+    def __init__(self, raw, decoder):
+        self.raw = raw
+        self.decoder = decoder
+        self.decoded = None
+
+    @property
+    def value(self):
+        if self.decoded is None:
+            self.decoded = self.decoder(self.raw)
+        return self.decoded
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
+
+    def __getitem__(self, k):
+        return self.value[k]
+
+    def __contains__(self, k):
+        return k in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __eq__(self, o):
+        if isinstance(o, LazyField):
+            o = o.value
+        return self.value == o
+
+    def __ne__(self, o):
+        return not self == o
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def _decode_metadata(raw):
+    return _metadata(raw, 0)[0]
+
+
+def read_lazy_metadata(name="metadata"):
+    def read(buf, offset, fields):
+        end = skip_metadata(buf, offset)
+        fields[name] = LazyField(str(buf[offset:end]), _decode_metadata)
+        return end
+    return read
+
+
+def _lazy_slotdata(buf, offset):
+    end = _check(buf, offset + 2)
+    item_id = _sshort.unpack_from(buf, offset)[0]
+    if item_id < 0:
+        return Container(id=item_id), end
+    offset = end
+    end = _check(buf, offset + _slot_info.size)
+    count, damage, size = _slot_info.unpack_from(buf, offset)
+    data = None
+    if size >= 0:
+        offset = end
+        end = _check(buf, offset + size)
+        data = LazyField(str(buf[offset:end]), parse_nbt)
+    return Container(id=item_id, count=count, damage=damage, size=size, data=data), end
+
+
+def read_lazy_slotdata(name="slotdata"):
+    def read(buf, offset, fields):
+        fields[name], offset = _lazy_slotdata(buf, offset)
+        return offset
+    return read
+
+
+# Skippers only find where the packet ends, nothing is decoded or allocated
+# beside the few integers needed for the length.
+
+def skip_fixed(fmt):
+    size = struct.calcsize(fmt)
+
+    def skip(buf, offset):
+        return _check(buf, offset + size)
+    return skip
+
+
+def skip_string(buf, offset):
+    end = _check(buf, offset + 2)
+    return _check(buf, end + _ushort.unpack_from(buf, offset)[0] * 2)
+
+
+def skip_slotdata(buf, offset):
+    end = _check(buf, offset + 2)
+    if _sshort.unpack_from(buf, offset)[0] < 0:
+        return end
+    offset = end
+    end = _check(buf, offset + _slot_info.size)
+    size = _slot_info.unpack_from(buf, offset)[2]
+    if size >= 0:
+        end = _check(buf, end + size)
+    return end
+
+
+def skip_slotdata_array(buf, offset):
+    end = _check(buf, offset + 2)
+    for _ in xrange(_sshort.unpack_from(buf, offset)[0]):
+        end = skip_slotdata(buf, end)
+    return end
+
+
+def skip_metadata(buf, offset):
+    while True:
+        offset = _check(buf, offset + 1)
+        key = _ubyte.unpack_from(buf, offset - 1)[0]
+        if key == 0x7f:
+            return offset
+        mtype = key >> 5
+        if mtype in _metadata_values:
+            offset = _check(buf, offset + _metadata_values[mtype].size)
+        elif mtype == 4:
+            offset = skip_string(buf, offset)
+        elif mtype == 5:
+            end = _check(buf, offset + 2)
+            if _sshort.unpack_from(buf, offset)[0] != -1:
+                end = _check(buf, end + _short_tup_rest.size)
+            offset = end
+        elif mtype == 6:
+            offset = _check(buf, offset + _int_tup.size)
+        else:
+            raise PacketIncomplete(len(buf) + 1)
+
+
+def skip_sized(fmt, size_index):
+    """
+    fixed part followed by as many bytes as says field number size_index
+    """
+    unpacker = struct.Struct(fmt)
+    unpack_from = unpacker.unpack_from
+    fixed = unpacker.size
+
+    def skip(buf, offset):
+        end = _check(buf, offset + fixed)
+        size = unpack_from(buf, offset)[size_index]
+        if size > 0:
+            end = _check(buf, end + size)
+        return end
+    return skip
+
+
+def compile_skipper(*skippers):
+    if len(skippers) == 1:
+        return skippers[0]
+
+    def skip(buf, offset):
+        for skipper in skippers:
+            offset = skipper(buf, offset)
+        return offset
+    return skip
+
+
+def compile_decoder(*readers):
+    def decode(buf, offset):
+        fields = {}
+        for reader in readers:
+            offset = reader(buf, offset, fields)
+        return Container(**fields), offset
+    return decode
+
+
+def construct_decoder(pid):
+    """
+    fallback for rare packets
+    """
+    con = packets[pid]
+
+    def decode(buf, offset):
+        # read the buffer in place, not a copy of all that follows
+        stream = cStringIO.StringIO(buffer(buf, offset))
+        try:
+            c = con.parse_stream(stream)
+        except ConstructError:
+            raise PacketIncomplete(len(buf) + 1)
+        return c, offset + stream.tell()
+    return decode
+
+
+_position = read_struct("position", read_fields(">dddd", "x", "y", "stance", "z"))
+_orientation = read_struct("orientation", read_fields(">ff", "yaw", "pitch"))
+_grounded = read_struct("grounded", read_fields(">B", "grounded"))
+
+fast_packets = {
+    0: compile_decoder(read_fields(">i", "pid")),
+    1: compile_decoder(read_fields(">i", "eid"),
+                       read_string("level_type"),
+                       read_fields(">bbbBB", "game_mode", "dimension", "difficulty", "unused", "players")),
+    3: compile_decoder(read_string("message")),
+    4: compile_decoder(read_fields(">qq", "timestamp", "daytime")),
+    5: compile_decoder(read_fields(">IH", "eid", "slot"), read_slotdata()),
+    6: compile_decoder(read_fields(">iii", "x", "y", "z")),
+    7: compile_decoder(read_fields(">IIB", "eid", "target", "button")),
+    8: compile_decoder(read_fields(">hhf", "hp", "fp", "saturation")),
+    9: compile_decoder(read_fields(">iBBH", "dimension", "difficulty", "game_mode", "world_height"),
+                       read_string("level_type")),
+    10: compile_decoder(read_fields(">B", "grounded")),
+    11: compile_decoder(_position, _grounded),
+    12: compile_decoder(_orientation, _grounded),
+    13: compile_decoder(_position, _orientation, _grounded),
+    14: compile_decoder(read_fields(">Bibib", "state", "x", "y", "z", "face")),
+    17: compile_decoder(read_fields(">IBiBi", "eid", "unknown", "x", "y", "z")),
+    18: compile_decoder(read_fields(">IB", "eid", "animation")),
+    19: compile_decoder(read_fields(">IB", "eid", "action")),
+    20: compile_decoder(read_fields(">I", "eid"),
+                        read_string("username"),
+                        read_fields(">iiiBBh", "x", "y", "z", "yaw", "pitch", "item"),
+                        read_metadata()),
+    21: compile_decoder(read_fields(">I", "eid"),
+                        read_slotdata(),
+                        read_fields(">iiibbb", "x", "y", "z", "yaw", "pitch", "roll")),
+    22: compile_decoder(read_fields(">II", "eid", "destination")),
+    23: compile_decoder(read_fields(">IBiiii", "eid", "type", "x", "y", "z", "object_data"),
+                        read_if(lambda f: f["object_data"] != 0,
+                                read_struct("velocity", read_fields(">HHH", "x", "y", "z")),
+                                "velocity")),
+    24: compile_decoder(read_fields(">IBiiibbbHHH", "eid", "type", "x", "y", "z",
+                                    "yaw", "pitch", "head_yaw",
+                                    "velocity_z", "velocity_x", "velocity_y"),
+                        read_metadata()),
+    25: compile_decoder(read_fields(">I", "eid"),
+                        read_string("title"),
+                        read_fields(">iiiI", "x", "y", "z", "direction")),
+    26: compile_decoder(read_fields(">IiiiH", "eid", "x", "y", "z", "count")),
+    28: compile_decoder(read_fields(">Ihhh", "eid", "dx", "dy", "dz")),
+    29: compile_decoder(read_fields(">b", "count"),
+                        read_array("eids", "count", array_item(">I"))),
+    30: compile_decoder(read_fields(">I", "eid")),
+    31: compile_decoder(read_fields(">Ibbb", "eid", "dx", "dy", "dz")),
+    32: compile_decoder(read_fields(">IBB", "eid", "yaw", "pitch")),
+    33: compile_decoder(read_fields(">IbbbBB", "eid", "dx", "dy", "dz", "yaw", "pitch")),
+    34: compile_decoder(read_fields(">IiiiBB", "eid", "x", "y", "z", "yaw", "pitch")),
+    35: compile_decoder(read_fields(">IB", "eid", "yaw")),
+    38: compile_decoder(read_fields(">ib", "eid", "status")),
+    39: compile_decoder(read_fields(">II", "eid", "vid")),
+    40: compile_decoder(read_fields(">I", "eid"), read_metadata()),
+    41: compile_decoder(read_fields(">IBBH", "eid", "effect", "amount", "duration")),
+    42: compile_decoder(read_fields(">IB", "eid", "effect")),
+    43: compile_decoder(read_fields(">fHH", "current", "level", "total")),
+    51: compile_decoder(read_fields(">ii?HHi", "x", "z", "continuous", "primary_bitmap", "add_bitmap", "size"),
+                        read_bytes("data", "size")),
+    52: compile_decoder(read_fields(">iiHi", "x", "z", "count", "datasize"),
+                        read_array("blocks", "count", _block_record)),
+    53: compile_decoder(read_fields(">iBiHB", "x", "y", "z", "type", "meta")),
+    54: compile_decoder(read_fields(">ihiBBH", "x", "y", "z", "byte1", "byte2", "block_id")),
+    55: compile_decoder(read_fields(">iiiiB", "eid", "x", "y", "z", "distance")),
+    56: compile_decoder(read_fields(">hi", "count", "size"),
+                        read_bytes("data", "size"),
+                        read_array("meta", "count",
+                                   array_item(">iihh", "x", "z", "primary_bitmap", "add_bitmap"))),
+    60: compile_decoder(read_fields(">dddfI", "x", "y", "z", "radius", "count"),
+                        read_array("records", "count", array_item(">bbb", "x", "y", "z")),
+                        read_fields(">fff", "unknown1", "unknown2", "unknown3")),
+    61: compile_decoder(read_fields(">Iibii?", "sid", "x", "y", "z", "data", "volume_decrease")),
+    62: compile_decoder(read_string("sound_name"),
+                        read_fields(">iIifB", "x", "y", "z", "volume", "pitch")),
+    70: compile_decoder(read_fields(">BB", "state", "creative")),
+    71: compile_decoder(read_fields(">I?iii", "eid", "unknown", "x", "y", "z")),
+    101: compile_decoder(read_fields(">B", "wid")),
+    103: compile_decoder(read_fields(">bh", "wid", "slot"), read_slotdata()),
+    104: compile_decoder(read_fields(">bh", "window_id", "length"),
+                        read_array("slotdata", "length", _slotdata)),
+    105: compile_decoder(read_fields(">BHH", "wid", "bar", "progress")),
+    106: compile_decoder(read_fields(">BH?", "wid", "token", "acknowledged")),
+    108: compile_decoder(read_fields(">BB", "wid", "enchantment")),
+    130: compile_decoder(read_fields(">iHi", "x", "y", "z"),
+                        read_string("line1"),
+                        read_string("line2"),
+                        read_string("line3"),
+                        read_string("line4")),
+    132: compile_decoder(read_fields(">iHibh", "x", "y", "z", "action", "size"),
+                        read_if(lambda f: f["size"] > 0, read_nbt("nbt", "size"), "nbt")),
+    200: compile_decoder(read_fields(">IB", "sid", "count")),
+    201: compile_decoder(read_string("name"), read_fields(">?H", "online", "ping")),
+    202: compile_decoder(read_abilities, read_fields(">BB", "walking_speed", "flying_speed")),
+    203: compile_decoder(read_string("text")),
+    205: compile_decoder(read_fields(">B", "status")),
+    252: compile_decoder(read_fields(">H", "shared_length"),
+                         read_bytes("shared_secret", "shared_length"),
+                         read_fields(">H", "token_length"),
+                         read_bytes("token_secret", "token_length")),
+    253: compile_decoder(read_string("server_id"),
+                         read_fields(">H", "public_key_length"),
+                         read_bytes("public_key", "public_key_length"),
+                         read_fields(">H", "token_length"),
+                         read_bytes("verify_token", "token_length")),
+    254: compile_decoder(read_fields(">B", "magic_number")),
+    255: compile_decoder(read_string("message")),
+}
+
+packet_decoders = dict((pid, construct_decoder(pid)) for pid in packets)
+packet_decoders.update(fast_packets)
+
+# metadata and slot NBT are kept as raw bytes until handler touches them
+lazy_packets = {
+    20: compile_decoder(read_fields(">I", "eid"),
+                        read_string("username"),
+                        read_fields(">iiiBBh", "x", "y", "z", "yaw", "pitch", "item"),
+                        read_lazy_metadata()),
+    21: compile_decoder(read_fields(">I", "eid"),
+                        read_lazy_slotdata(),
+                        read_fields(">iiibbb", "x", "y", "z", "yaw", "pitch", "roll")),
+    24: compile_decoder(read_fields(">IBiiibbbHHH", "eid", "type", "x", "y", "z",
+                                    "yaw", "pitch", "head_yaw",
+                                    "velocity_z", "velocity_x", "velocity_y"),
+                        read_lazy_metadata()),
+    40: compile_decoder(read_fields(">I", "eid"), read_lazy_metadata()),
+}
+
+lazy_packet_decoders = dict(packet_decoders)
+lazy_packet_decoders.update(lazy_packets)
+
+packet_skippers = {
+    5: compile_skipper(skip_fixed(">IH"), skip_slotdata),
+    17: skip_fixed(">IBiBi"),
+    18: skip_fixed(">IB"),
+    22: skip_fixed(">II"),
+    35: skip_fixed(">IB"),
+    41: skip_fixed(">IBBH"),
+    42: skip_fixed(">IB"),
+    54: skip_fixed(">ihiBBH"),
+    55: skip_fixed(">iiiiB"),
+    61: skip_fixed(">Iibii?"),
+    62: compile_skipper(skip_string, skip_fixed(">iIifB")),
+    70: skip_fixed(">BB"),
+    71: skip_fixed(">I?iii"),
+    103: compile_skipper(skip_fixed(">bh"), skip_slotdata),
+    104: compile_skipper(skip_fixed(">b"), skip_slotdata_array),
+    105: skip_fixed(">BHH"),
+    106: skip_fixed(">BH?"),
+    132: skip_sized(">iHibh", 4),
+    200: skip_fixed(">IB"),
+    202: skip_fixed(">BBB"),
+    203: skip_string,
+}
+
+
+def decode_packet(buf, offset, decoders=packet_decoders):
+    """
+    Decode one packet starting at offset.
+
+    Returns a tuple of packet header, payload and offset where next packet
+    starts. Raises PacketIncomplete if the packet is not whole in the buffer
+    and PacketError on an unknown packet id.
+    """
+    end = _check(buf, offset + 1)
+    header = _ubyte.unpack_from(buf, offset)[0]
+    decoder = decoders.get(header, None)
+    if decoder is None:
+        raise PacketError("unknown packet id %d" % header)
+    payload, end = decoder(buf, end)
+    return header, payload, end
+
+
 def parse_packets(bytestream):
     """
     Opportunistically parse out as many packets as possible from a raw
@@ -704,6 +1298,109 @@ def parse_packets(bytestream):
     Returns a tuple containing a list of unpacked packet containers, and any
     leftover unparseable bytes.
     """
+    l = []
+    offset = 0
+    while offset < len(bytestream):
+        try:
+            header, payload, offset_next = decode_packet(bytestream, offset)
+        except PacketIncomplete:
+            break
+        l.append((header, payload))
+        offset = offset_next
+    leftovers = bytestream[offset:]
+
+    return l, leftovers
+
+
+class PacketStream(object):
+    """
+    Receive buffer for one direction of the connection.
+
+    Incoming bytes are appended to a bytearray and a packet is decoded only
+    once all of its bytes are present. When decoding stops on an incomplete
+    packet, the buffer length it needs is remembered, so a big packet
+    arriving in many TCP segments is not re-parsed for every segment.
+
+    Packets with id in skip are not decoded at all, only their length is
+    computed and they are left out of the output. With lazy set, entity
+    metadata and slot NBT are decoded on first access. With keep_raw set,
+    raw holds the bytes of each packet of the last feed output.
+    """
+
+    def __init__(self, skip=(), lazy=False, keep_raw=False):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.need = 0
+        self.skippers = dict((pid, packet_skippers[pid]) for pid in skip if pid in packet_skippers)
+        self.decoders = lazy_packet_decoders if lazy else packet_decoders
+        self.bytes_decoded = defaultdict(int)
+        self.bytes_skipped = defaultdict(int)
+        self.packets_skipped = 0
+        self.keep_raw = keep_raw
+        self.raw = []
+
+    def __len__(self):
+        return len(self.buffer) - self.offset
+
+    @property
+    def leftover(self):
+        return str(self.buffer[self.offset:])
+
+    def feed(self, bytestream):
+        """
+        Add received bytes, returns list of (header, payload) tuples of the
+        packets that are now complete.
+        """
+        buf = self.buffer
+        buf.extend(bytestream)
+        out = []
+        if self.keep_raw:
+            self.raw = []
+        if len(buf) < self.need:
+            return out
+        offset = self.offset
+        skippers = self.skippers
+        decoders = self.decoders
+        self.need = 0
+        while offset < len(buf):
+            header = buf[offset]
+            try:
+                if header in skippers:
+                    end = skippers[header](buf, offset + 1)
+                    self.bytes_skipped[header] += end - offset
+                    self.packets_skipped += 1
+                else:
+                    header, payload, end = decode_packet(buf, offset, decoders)
+                    self.bytes_decoded[header] += end - offset
+                    out.append((header, payload))
+                    if self.keep_raw:
+                        self.raw.append(str(buf[offset:end]))
+            except PacketIncomplete as e:
+                self.need = e.need
+                break
+            offset = end
+        if offset * 2 >= len(buf):
+            del buf[:offset]
+            self.need = max(0, self.need - offset)
+            offset = 0
+        self.offset = offset
+        return out
+
+    def stats(self):
+        """
+        per packet id (bytes decoded, bytes skipped)
+        """
+        out = {}
+        for pid in set(self.bytes_decoded.keys()) | set(self.bytes_skipped.keys()):
+            out[pid] = (self.bytes_decoded[pid], self.bytes_skipped[pid])
+        return out
+
+
+def parse_packets_construct(bytestream):
+    """
+    Same as parse_packets using only construct definitions. Slow, kept as
+    a reference for checking the fast decoders.
+    """
 
     container = packet_stream.parse(bytestream)
 
@@ -3,72 +3,72 @@ import heapq
 
 import config
 import logbot
+import blocks
+from gridspace import GridSpace
 
 
 log = logbot.getlogger("ASTAR")
 
+INF = float('inf')
+MIN_EDGE_COST = 0.001  # D* Lite needs positive costs, water columns have zero cost edges
+HEURISTIC_SCALE = 0.999  # float32 edge costs round sqrt(2) down, D* Lite needs a consistent estimate
 
-class PathNode(object):
-    def __init__(self, coords, cost=1):
-        self.coords = coords
-        self.cost = cost
-        self.g = 0
-        self.h = 0
-        self.f = 0
-        self.step = 0
-        self._parent = None
-        self.hash = hash(self.coords)
 
-    def __str__(self):
-        return "%s:%s:g%s:h%s:f%s" % \
-            (str(self.coords), self.cost, self.g, self.h, self.f)
-
-    def __repr__(self):
-        return self.__str__()
-
-    def __lt__(self, other):
-        return self.f < other.f
-
-    def __eq__(self, other):
-        return self.hash == other.__hash__()
+def octile_distance(start, goal):
+    h_diagonal = min(abs(start[0] - goal[0]), abs(start[2] - goal[2]))
+    h_straight = (abs(start[0] - goal[0]) + abs(start[2] - goal[2]))
+    return config.COST_DIAGONAL * h_diagonal + \
+        config.COST_DIRECT * (h_straight - 2 * h_diagonal)
 
-    def __hash__(self):
-        return self.hash
 
-    def __getitem__(self, i):
-        return self.coords[i]
+def chunk_distance(crd1, crd2):
+    return max(abs((crd1[0] >> 4) - (crd2[0] >> 4)), abs((crd1[2] >> 4) - (crd2[2] >> 4)))
 
-    @property
-    def parent(self):
-        return self._parent
 
-    @parent.setter
-    def parent(self, p):
-        self._parent = p
-        self.step = p.step + 1
+class LandmarkEstimate(object):
+    """
+    octile distance to goal raised by the triangle inequality bounds of
+    the navgrid landmarks (ALT), only the octile distance while the
+    tables are stale or for nodes they do not know
+    """
+    def __init__(self, navgrid, start, goal):
+        self.index = navgrid.graph.index
+        self.goal = goal
+        self.tables = navgrid.landmarks
+        self.refreshes = self.tables.refreshes
+        self.landmarks = self.tables.active(start, goal)
+        self.gid = self.index.get(goal, None)
 
-    def set_score(self, g, h):
-        self.g = g
-        self.h = h
-        self.f = g + h
+    def __call__(self, crd):
+        h = octile_distance(crd, self.goal)
+        tables = self.tables
+        if not self.landmarks or tables.pending or tables.graph.shortened or tables.refreshes != self.refreshes:
+            return h
+        nid = self.index.get(crd, None)
+        gid = self.gid
+        known = tables.generation
+        current = tables.graph.generation
+        if nid is None or nid >= len(known) or known[nid] != current[nid] or known[gid] != current[gid]:
+            return h
+        for to_table, from_table in self.landmarks:
+            goal_to = to_table[gid]
+            goal_from = from_table[gid]
+            d = to_table[nid]
+            if d < INF and goal_to < INF and d - goal_to > h:
+                h = d - goal_to
+            if goal_from < INF and goal_from - from_table[nid] > h:
+                h = goal_from - from_table[nid]
+        return h
 
 
 class Path(object):
-    def __init__(self, goal=None):
-        self.goal = goal
-        self.nodes = []
-        self.reconstruct_path(self.goal)
+    def __init__(self, nodes):
+        self.nodes = nodes
         self.step_index = len(self.nodes)
 
     def __str__(self):
         return "Path nodes %s" % [str(n) for n in self.nodes]
 
-    def reconstruct_path(self, current):
-        self.nodes.append(current)
-        while current.parent is not None:
-            self.nodes.append(current.parent)
-            current = current.parent
-
     def __iter__(self):
         self.iter_index = len(self.nodes)
         return self
@@ -88,67 +88,350 @@ class Path(object):
             raise Exception("Path consumed")
         return self.nodes[self.step_index]
 
+    def leg(self, chunks=config.PATHFIND_CHUNKS):
+        """
+        the start of the path up to its farthest node at most chunks away
+        """
+        start = self.nodes[-1]
+        k = len(self.nodes) - 1
+        while k > 0 and chunk_distance(start, self.nodes[k - 1]) <= chunks:
+            k -= 1
+        return Path(self.nodes[k:])
+
+    def passing(self):
+        """
+        nodes between the last two steps taken, a merged step goes over them
+        """
+        if self.step_index + 1 >= len(self.nodes):
+            return []
+        x1, y1, z1 = self.nodes[self.step_index + 1]
+        x2, _, z2 = self.nodes[self.step_index]
+        n = max(abs(x2 - x1), abs(z2 - z1))
+        if n < 2:
+            return []
+        dx = (x2 - x1) / n
+        dz = (z2 - z1) / n
+        return [(x1 + dx * i, y1, z1 + dz * i) for i in xrange(1, n)]
+
+    def flat_space(self, grid, crd):
+        """
+        standing box on crd if it can be walked over without ladder or water
+        """
+        gs = GridSpace(grid, coords=crd)
+        if not gs.can_stand_on:
+            return None
+        if grid.aabb_flags(gs.bb_stand) & (blocks.LIQUID | blocks.LADDER_VINE):
+            return None
+        return gs.bb_stand
+
+    def smooth(self, grid, max_length=config.PATH_SEGMENT):
+        """
+        merge straight runs of nodes on one level into single steps, sweep
+        along the run with collision_between has to be clear, otherwise the
+        run is halved until it is
+        """
+        nodes = self.nodes[::-1]
+        if len(nodes) < 3:
+            return Path(list(self.nodes))
+        stand = [self.flat_space(grid, crd) for crd in nodes]
+        out = [nodes[0]]
+        i = 0
+        last = len(nodes) - 1
+        while i < last:
+            j = i + 1
+            if stand[i] is not None and stand[j] is not None and \
+                    stand[i].min_y == stand[j].min_y and nodes[i][1] == nodes[j][1]:
+                d = (nodes[j][0] - nodes[i][0], nodes[j][2] - nodes[i][2])
+                while j < last and j - i < max_length:
+                    k = j + 1
+                    if stand[k] is None or stand[k].min_y != stand[i].min_y or nodes[k][1] != nodes[i][1]:
+                        break
+                    if (nodes[k][0] - nodes[j][0], nodes[k][2] - nodes[j][2]) != d:
+                        break
+                    j = k
+                while j > i + 1 and grid.collision_between(stand[i], stand[j]):
+                    j = i + (j - i) / 2
+            out.append(nodes[j])
+            i = j
+        return Path(out[::-1])
+
 
 class AStar(object):
+    """
+    works on coordinate tuples, open_heap holds (f, h, coords) entries,
+    stale entries are skipped when popped instead of updated in place
+    """
     def __init__(self, navgrid, start, goal, max_cost=config.PATHFIND_LIMIT):
         self.navgrid = navgrid
         self.succesors = self.navgrid.graph.get_succ
-        self.get_node = self.navgrid.graph.get_node
-        self.start_node = PathNode(start)
-        self.goal_node = PathNode(goal)
+        self.start = start
+        self.goal = goal
         self.max_cost = max_cost
         self.path = None
+        self.expanded = 0
+        self.g = {start: 0}
+        self.came_from = {start: None}
+        self.steps = {start: 0}
         self.closed_set = set()
-        self.open_heap = [self.start_node]
-        self.open_set = set([self.start_node])
-        self.start_node.set_score(
-            0, self.heuristic_cost_estimate(self.start_node, self.goal_node))
+        self.heuristic_cost_estimate = LandmarkEstimate(navgrid, start, goal)
+        h = self.heuristic_cost_estimate(start)
+        self.open_heap = [(h, h, start)]
 
     def reconstruct_path(self, current):
         nodes = []
-        nodes.append(current)
-        while current.parent is not None:
-            nodes.append(current.parent)
-            current = current.parent
-        nodes.reverse()
+        came_from = self.came_from
+        while current is not None:
+            nodes.append(current)
+            current = came_from[current]
         return nodes
 
-    def get_edge_cost(self, node_from, node_to):
-        return self.navgrid.graph.get_edge(node_from.coords, node_to.coords)
+    def next(self):
+        open_heap = self.open_heap
+        closed_set = self.closed_set
+        while open_heap:
+            _, _, x = heapq.heappop(open_heap)
+            if x not in closed_set:
+                break
+        else:
+            log.err("Did not find path between %s and %s" % (self.start, self.goal))
+            raise StopIteration()
+        if x == self.goal:
+            self.path = Path(self.reconstruct_path(x))
+            raise StopIteration()
+        closed_set.add(x)
+        self.expanded += 1
+        g = self.g
+        heuristic = self.heuristic_cost_estimate
+        x_g = g[x]
+        step = self.steps[x] + 1
+        for y, cost in self.succesors(x):
+            if y in closed_set:
+                continue
+            tentative_g_core = x_g + cost
+            if tentative_g_core < g.get(y, tentative_g_core + 1):
+                g[y] = tentative_g_core
+                self.came_from[y] = x
+                self.steps[y] = step
+                h = heuristic(y)
+                heapq.heappush(open_heap, (tentative_g_core + h, h, y))
+                if step > self.max_cost:
+                    log.err("Finding path over limit between %s and %s" % (self.start, self.goal))
+                    raise StopIteration()
+
 
-    def neighbours(self, start):
-        for node, cost in self.succesors(start.coords):
-            if node not in self.closed_set:
-                yield PathNode(node, cost=cost)
+class DStarLite(object):
+    """
+    D* Lite, searches from goal back towards start so the search state
+    survives moving the start. navgrid reports nodes whose edges changed
+    with node_changed, next() repairs only the inconsistent nodes.
+    path is set once start is consistent again.
+    """
+    def __init__(self, navgrid, start, goal, max_cost=config.PATHFIND_LIMIT):
+        self.graph = navgrid.graph
+        self.start = start
+        self.goal = goal
+        self.max_cost = max_cost * config.COST_DIAGONAL
+        self.km = 0
+        self.g = {}
+        self.rhs = {goal: 0}
+        self.keys = {}
+        self.open_heap = []
+        self.path = None
+        self.expanded = 0
+        self.push(goal)
+        navgrid.planners.add(self)
 
-    def heuristic_cost_estimate(self, start, goal):
-        h_diagonal = min(abs(start[0] - goal[0]), abs(start[2] - goal[2]))
-        h_straight = (abs(start[0] - goal[0]) + abs(start[2] - goal[2]))
-        h = config.COST_DIAGONAL * h_diagonal + \
-            config.COST_DIRECT * (h_straight - 2 * h_diagonal)
-        return h
+    def heuristic(self, crd1, crd2):
+        return octile_distance(crd1, crd2) * HEURISTIC_SCALE
+
+    def calculate_key(self, crd):
+        g = min(self.g.get(crd, INF), self.rhs.get(crd, INF))
+        return (g + self.heuristic(self.start, crd) + self.km, g)
+
+    def push(self, crd):
+        key = self.calculate_key(crd)
+        self.keys[crd] = key
+        heapq.heappush(self.open_heap, (key, crd))
+
+    def succesors(self, crd):
+        return [(succ, max(cost, MIN_EDGE_COST)) for succ, cost in self.graph.get_succ(crd)]
+
+    def predecessors(self, crd):
+        return [(pred, max(cost, MIN_EDGE_COST)) for pred, cost in self.graph.get_pred(crd)]
+
+    def compute_rhs(self, crd):
+        rhs = INF
+        if self.graph.has_node(crd):
+            g = self.g
+            for succ, cost in self.graph.get_succ(crd):
+                if cost < MIN_EDGE_COST:
+                    cost = MIN_EDGE_COST
+                c = cost + g.get(succ, INF)
+                if c < rhs:
+                    rhs = c
+        if rhs == INF:
+            self.rhs.pop(crd, None)
+        else:
+            self.rhs[crd] = rhs
+
+    def update_vertex(self, crd):
+        self.keys.pop(crd, None)
+        if self.g.get(crd, INF) != self.rhs.get(crd, INF):
+            self.push(crd)
+
+    def node_changed(self, crd):
+        if crd != self.goal:
+            self.compute_rhs(crd)
+            self.update_vertex(crd)
+        self.path = None
+
+    def move_start(self, start):
+        self.km += self.heuristic(self.start, start)
+        self.start = start
+        self.path = None
 
     def next(self):
-        if not self.open_set:
-            log.err("Did not find path between %s and %s" % (self.start_node.coords, self.goal_node.coords))
+        open_heap = self.open_heap
+        keys = self.keys
+        while open_heap and keys.get(open_heap[0][1]) != open_heap[0][0]:
+            heapq.heappop(open_heap)
+        start_key = self.calculate_key(self.start)
+        if not open_heap or (open_heap[0][0] >= start_key and
+                             self.rhs.get(self.start, INF) == self.g.get(self.start, INF)):
+            if self.g.get(self.start, INF) == INF:
+                log.err("Did not find path between %s and %s" % (self.start, self.goal))
+            else:
+                self.path = self.extract_path()
             raise StopIteration()
-        x = heapq.heappop(self.open_heap)
-        if x == self.goal_node:
-            self.path = Path(goal=x)
+        if open_heap[0][0][0] - self.km > self.max_cost:
+            log.err("Finding path over limit between %s and %s" % (self.start, self.goal))
             raise StopIteration()
-        self.open_set.remove(x)
-        self.closed_set.add(x)
-        for y in self.neighbours(x):
-            if y in self.closed_set:
+        key, crd = heapq.heappop(open_heap)
+        new_key = self.calculate_key(crd)
+        if key < new_key:
+            self.push(crd)
+            return
+        del keys[crd]
+        self.expanded += 1
+        g = self.g
+        rhs = self.rhs
+        g_old = g.get(crd, INF)
+        preds = self.predecessors(crd) if self.graph.has_node(crd) else ()
+        if g_old > rhs.get(crd, INF):
+            g_new = g[crd] = rhs[crd]
+            for pred, cost in preds:
+                if cost + g_new < rhs.get(pred, INF):
+                    rhs[pred] = cost + g_new
+                    self.update_vertex(pred)
+        else:
+            g.pop(crd, None)
+            for pred, cost in preds:
+                if pred != self.goal and rhs.get(pred) == cost + g_old:
+                    self.compute_rhs(pred)
+                    self.update_vertex(pred)
+            if crd != self.goal:
+                self.compute_rhs(crd)
+            self.update_vertex(crd)
+
+    def extract_path(self):
+        g = self.g
+        crd = self.start
+        nodes = [crd]
+        visited = set(nodes)
+        while crd != self.goal:
+            best = None
+            best_cost = (INF, INF)
+            for succ, cost in self.succesors(crd):
+                succ_g = g.get(succ, INF)
+                c = (cost + succ_g, succ_g)
+                if c < best_cost and succ not in visited:
+                    best = succ
+                    best_cost = c
+            if best is None:
+                return None
+            crd = best
+            nodes.append(crd)
+            visited.add(crd)
+        nodes.reverse()
+        return Path(nodes)
+
+
+class ChunkAStar(object):
+    """
+    A* over chunk entrances (navigationgrid.ChunkGraph). path is the list
+    of coordinates from start over entrances to goal, refine it with
+    AStar one leg at a time. costs inside a chunk take long the first
+    time, the search gives up as cold once it computed them for more than
+    max_computed chunks.
+    """
+    def __init__(self, navgrid, start, goal, max_computed=None):
+        self.chunk_graph = navgrid.chunk_graph
+        self.start = start
+        self.goal = goal
+        self.path = None
+        self.cold = False
+        self.max_computed = max_computed
+        self.computed = self.chunk_graph.computed
+        self.start_chunk = start[0] >> 4, start[2] >> 4
+        goal_chunk = goal[0] >> 4, goal[2] >> 4
+        self.to_goal = self.chunk_graph.costs_in_chunk(
+            goal, goal_chunk, self.chunk_graph.entrances(goal_chunk), reverse=True)
+        self.g = {start: 0}
+        self.parents = {start: None}
+        self.closed_set = set()
+        self.heuristic = LandmarkEstimate(navgrid, start, goal)
+        self.open_heap = [(self.heuristic(start), start)]
+
+    def succesors(self, crd):
+        if crd == self.start:
+            targets = self.chunk_graph.entrances(self.start_chunk)
+            targets.add(self.goal)
+            for to, cost in self.chunk_graph.costs_in_chunk(crd, self.start_chunk, targets).iteritems():
+                if to != crd:
+                    yield to, cost
+        else:
+            for to, cost in self.chunk_graph.get_paths((crd[0] >> 4, crd[2] >> 4)).get(crd, ()):
+                yield to, cost
+        for to, cost in self.chunk_graph.get_exits_from(crd):
+            yield to, cost
+        if crd in self.to_goal:
+            yield self.goal, self.to_goal[crd]
+
+    def next(self):
+        if not self.open_heap:
+            log.err("Did not find chunk path between %s and %s" % (self.start, self.goal))
+            raise StopIteration()
+        _, crd = heapq.heappop(self.open_heap)
+        if crd in self.closed_set:
+            return
+        if crd == self.goal:
+            self.path = []
+            while crd is not None:
+                self.path.append(crd)
+                crd = self.parents[crd]
+            self.path.reverse()
+            raise StopIteration()
+        if self.max_computed is not None and self.chunk_graph.computed - self.computed > self.max_computed:
+            self.cold = True
+            raise StopIteration()
+        self.closed_set.add(crd)
+        g = self.g[crd]
+        for to, cost in self.succesors(crd):
+            if to in self.closed_set:
                 continue
-            tentative_g_core = x.g + self.get_edge_cost(x, y)
-            if y not in self.open_set or tentative_g_core < y.g:
-                y.set_score(tentative_g_core,
-                            self.heuristic_cost_estimate(y, self.goal_node))
-                y.parent = x
-                if y not in self.open_set:
-                    heapq.heappush(self.open_heap, y)
-                    self.open_set.add(y)
-                if y.step > self.max_cost:
-                    log.err("Finding path over limit between %s and %s" % (self.start_node.coords, self.goal_node.coords))
-                    raise StopIteration()
+            tentative_g = g + cost
+            if to not in self.g or tentative_g < self.g[to]:
+                self.g[to] = tentative_g
+                self.parents[to] = crd
+                heapq.heappush(self.open_heap, (tentative_g + self.heuristic(to), to))
+
+    def leg_goal(self, chunks=config.PATHFIND_CHUNKS):
+        """
+        farthest point on the path at most chunks away from start
+        """
+        leg = self.path[0]
+        for crd in self.path[1:]:
+            if chunk_distance(self.start, crd) > chunks:
+                break
+            leg = crd
+        return leg
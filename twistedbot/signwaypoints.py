@@ -41,6 +41,7 @@ class SignWayPoints(object):
                 msg += "name '%s'" % sign.name
             #log.msg(msg)
         self.crd_to_sign[sign.coords] = sign
+        self.navgrid.landmarks.changed()
 
     def remove(self, crd):
         if crd in self.crd_to_sign:
@@ -85,7 +86,7 @@ class SignWayPoints(object):
             s = sgroup.next_rotate()
             if s == cs:
                 return None
-            if self.navgrid.graph.has_node(tools.lower_y(s.coords)):
+            if self.navgrid.reachable(s.nav_coords):
                 return s
 
     def get_groupnext_circulate(self, group):
@@ -103,7 +104,7 @@ class SignWayPoints(object):
                 n_pass += 1
                 if n_pass == 2:
                     return None
-            if self.navgrid.graph.has_node(tools.lower_y(s.coords)):
+            if self.navgrid.reachable(s.nav_coords):
                 return s
 
     def reset_group(self, group):
@@ -1,10 +1,16 @@
 
 import re
+import sys
 import math
+import time
 import functools
+from array import array
+from collections import deque
 
 from twisted.internet import defer, reactor
+from twisted.python import failure
 
+import config
 import logbot
 
 
@@ -36,6 +42,120 @@ def reactor_break():
     return d
 
 
+class WorkTask(object):
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.deferreds = []
+        self.done = False
+        self.result = None
+
+    def whenDone(self):
+        d = defer.Deferred()
+        if self.done:
+            self.fire(d)
+        else:
+            self.deferreds.append(d)
+        return d
+
+    def fire(self, d):
+        if isinstance(self.result, failure.Failure):
+            d.errback(self.result)
+        else:
+            d.callback(self.result)
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        deferreds, self.deferreds = self.deferreds, []
+        for d in deferreds:
+            self.fire(d)
+
+
+class WorkScheduler(object):
+    """
+    runs iterators round robin, as many steps as fit in slice_time per
+    reactor turn. steps are not started when the physics tick is due
+    within reserve, the slice is resumed after the tick.
+    """
+    def __init__(self, slice_time=config.WORK_SLICE, reserve=config.WORK_TICK_RESERVE):
+        self.slice_time = slice_time
+        self.reserve = reserve
+        self.tasks = deque()
+        self.delayed = None
+        self.tick_at = None
+        self.steps = 0
+        self.slices = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.overruns = 0
+
+    def __str__(self):
+        return "work scheduler queue %d max %d steps %d slices %d utilisation %.0f%% tick overruns %d" % \
+            (len(self.tasks), self.max_depth, self.steps, self.slices, self.utilisation * 100, self.overruns)
+
+    @property
+    def utilisation(self):
+        if self.slices == 0:
+            return 0.0
+        return self.busy / (self.slices * self.slice_time)
+
+    def cooperate(self, iterator):
+        task = WorkTask(iterator)
+        self.tasks.append(task)
+        self.max_depth = max(self.max_depth, len(self.tasks))
+        self.schedule(0)
+        return task
+
+    def next_tick(self, delay):
+        self.tick_at = time.time() + delay
+        if self.delayed is not None:
+            self.delayed.reset(0)
+
+    def schedule(self, delay):
+        if self.delayed is None:
+            self.delayed = reactor.callLater(delay, self.run)
+
+    def run(self):
+        self.delayed = None
+        start = time.time()
+        end = start + self.slice_time
+        tick_at = self.tick_at
+        if tick_at is not None and start < tick_at:
+            if tick_at - start <= self.reserve:
+                self.schedule(tick_at - start + 0.001)
+                return
+            end = min(end, tick_at - self.reserve)
+        tasks = self.tasks
+        now = start
+        while tasks and now < end:
+            task = tasks[0]
+            try:
+                task.iterator.next()
+            except StopIteration:
+                tasks.popleft()
+                task.finish(task.iterator)
+            except Exception:
+                tasks.popleft()
+                task.finish(failure.Failure())
+            else:
+                tasks.rotate(-1)
+            self.steps += 1
+            now = time.time()
+        self.slices += 1
+        self.busy += now - start
+        if tick_at is not None and start < tick_at < now:
+            self.overruns += 1
+        if tasks:
+            self.schedule(0)
+
+
+work_scheduler = WorkScheduler()
+
+
+def cooperate(iterator):
+    return work_scheduler.cooperate(iterator)
+
+
 def meta2str(meta):
     bins = bin(meta)[2:]
     bins = "0" * (8 - len(bins)) + bins
@@ -54,6 +174,10 @@ def vector_size(v):
     return math.sqrt(sum([p * p for p in v]))
 
 
+def distance_sq(p1, p2):
+    return sum([(a - b) * (a - b) for a, b in zip(p1, p2)])
+
+
 def normalize(v):
     d = vector_size(v)
     if d < 0.0001:
@@ -91,65 +215,230 @@ def yaw_pitch_to_vector(x, y, z):
     return yaw, -pitch
 
 
+# every edge the navgrid makes stays within one block horizontally and
+# three vertically, offsets are ordered so that the reverse of slot i is
+# slot EDGE_SLOTS - 1 - i
+edge_offsets = [(i, j, k) for i in (-1, 0, 1) for j in xrange(-3, 4) for k in (-1, 0, 1)
+                if not (i == j == k == 0)]
+edge_slots = dict((off, n) for n, off in enumerate(edge_offsets))
+EDGE_SLOTS = len(edge_offsets)
+# array('L') holds EDGE_SLOTS bits only where C long is 64 bits wide
+MASK_TYPECODE = 'L' if array('L').itemsize * 8 >= EDGE_SLOTS else None
+
+
+def mask_array():
+    """
+    growable store of edge masks, a list where array('L') is too narrow
+    """
+    return array(MASK_TYPECODE) if MASK_TYPECODE is not None else []
+
+
+def pack_masks(masks):
+    """
+    edge masks to a string of little endian 32 bit halves, low half first
+    """
+    halves = array('I', [0]) * (2 * len(masks))
+    halves[0::2] = array('I', [mask & 0xffffffff for mask in masks])
+    halves[1::2] = array('I', [mask >> 32 for mask in masks])
+    if sys.byteorder != "little":
+        halves.byteswap()
+    return halves.tostring()
+
+
+def unpack_masks(data):
+    """
+    list of edge masks from a string made by pack_masks
+    """
+    halves = array('I')
+    halves.fromstring(data)
+    if sys.byteorder != "little":
+        halves.byteswap()
+    return [low | high << 32 for low, high in zip(halves[0::2], halves[1::2])]
+
+
 class DirectedGraph(object):
+    """
+    nodes are coordinates mapped to integer ids, edges are bits in a per
+    node mask of neighbour offsets (edge_offsets) with costs in a float32
+    array of EDGE_SLOTS per node. ids of removed nodes are reused, the
+    generation of an id counts its reuses. border maps a chunk to its
+    nodes in the columns along the chunk border. shortened, once set to a
+    set, collects both ends of edges that are added or get cheaper.
+    """
     def __init__(self):
-        self.nodes = {}
-        self.pred = {}
-        self.succ = {}
+        self.index = {}
+        self.border = {}
+        self.free_ids = []
+        self.shortened = None
+        self.generation = array('I')
+        self.miny = array('d')
+        self.succ = mask_array()
+        self.pred = mask_array()
+        self.costs = array('f')
+        self.edges = 0
 
     @property
     def node_count(self):
-        return len(self.nodes)
+        return len(self.index)
 
     @property
     def edge_count(self):
-        return len(self.pred) + len(self.succ)
+        return self.edges
+
+    @property
+    def memory_size(self):
+        """
+        approximate bytes used by the graph
+        """
+        size = sys.getsizeof(self.index) + sys.getsizeof(self.free_ids) + sys.getsizeof(self.border)
+        size += sum(sys.getsizeof(nodes) for nodes in self.border.itervalues())
+        size += len(self.index) * _coords_size
+        for arr in (self.generation, self.miny, self.succ, self.pred, self.costs):
+            if isinstance(arr, list):
+                size += sys.getsizeof(arr) + len(arr) * sys.getsizeof(1 << 62)
+            else:
+                size += arr.buffer_info()[1] * arr.itemsize
+        return size
+
+    def __iter__(self):
+        return iter(self.index)
 
     def has_node(self, crd):
-        return crd in self.nodes
+        return crd in self.index
 
     def get_node(self, crd):
-        return self.nodes[crd]
+        return self.miny[self.index[crd]]
 
     def add_node(self, crd, miny=None):
-        if crd not in self.nodes:
-            self.nodes[crd] = miny
-            self.pred[crd] = {}
-            self.succ[crd] = {}
+        if crd in self.index:
+            return
+        if self.free_ids:
+            nid = self.free_ids.pop()
+            self.miny[nid] = miny
+            self.generation[nid] += 1
+        else:
+            nid = len(self.miny)
+            self.generation.append(0)
+            self.miny.append(miny)
+            self.succ.append(0)
+            self.pred.append(0)
+            self.costs.extend(_empty_costs)
+        self.index[crd] = nid
+        x, _, z = crd
+        if (x + 1) & 15 < 2 or (z + 1) & 15 < 2:
+            self.border.setdefault((x >> 4, z >> 4), set()).add(crd)
 
     def remove_node(self, crd):
         affected = set()
-        del self.nodes[crd]
-        for n in self.succ[crd].keys():
-            del self.pred[n][crd]
-            affected.add(n)
-        del self.succ[crd]
-        for n in self.pred[crd].keys():
-            del self.succ[n][crd]
-            affected.add(n)
-        del self.pred[crd]
+        nid = self.index.pop(crd)
+        x, y, z = crd
+        if (x + 1) & 15 < 2 or (z + 1) & 15 < 2:
+            nodes = self.border[(x >> 4, z >> 4)]
+            nodes.discard(crd)
+            if not nodes:
+                del self.border[(x >> 4, z >> 4)]
+        for masks, other_masks in ((self.succ, self.pred), (self.pred, self.succ)):
+            mask = masks[nid]
+            while mask:
+                bit = mask & -mask
+                mask ^= bit
+                slot = bit.bit_length() - 1
+                dx, dy, dz = edge_offsets[slot]
+                other = (x + dx, y + dy, z + dz)
+                other_masks[self.index[other]] &= ~(1 << (EDGE_SLOTS - 1 - slot))
+                affected.add(other)
+                self.edges -= 1
+            masks[nid] = 0
+        self.free_ids.append(nid)
         return affected
 
     def has_edge(self, crd1, crd2):
-        return crd2 in self.succ.get(crd1, {})
+        nid = self.index.get(crd1, None)
+        if nid is None:
+            return False
+        slot = edge_slots.get((crd2[0] - crd1[0], crd2[1] - crd1[1], crd2[2] - crd1[2]), None)
+        if slot is None:
+            return False
+        return (self.succ[nid] >> slot) & 1 == 1
 
     def get_edge(self, crd1, crd2):
-        try:
-            return self.succ[crd1][crd2]
-        except KeyError:
-            return None
+        if self.has_edge(crd1, crd2):
+            slot = edge_slots[(crd2[0] - crd1[0], crd2[1] - crd1[1], crd2[2] - crd1[2])]
+            return self.costs[self.index[crd1] * EDGE_SLOTS + slot]
+        return None
 
     def add_edge(self, crd1, crd2, cost):
-        self.succ[crd1][crd2] = cost
-        self.pred[crd2][crd1] = cost
+        nid1 = self.index[crd1]
+        nid2 = self.index[crd2]
+        slot = edge_slots[(crd2[0] - crd1[0], crd2[1] - crd1[1], crd2[2] - crd1[2])]
+        if not (self.succ[nid1] >> slot) & 1:
+            self.edges += 1
+            if self.shortened is not None:
+                self.shortened.add(crd1)
+                self.shortened.add(crd2)
+        elif self.shortened is not None and cost < self.costs[nid1 * EDGE_SLOTS + slot]:
+            self.shortened.add(crd1)
+            self.shortened.add(crd2)
+        self.succ[nid1] |= 1 << slot
+        self.pred[nid2] |= 1 << (EDGE_SLOTS - 1 - slot)
+        self.costs[nid1 * EDGE_SLOTS + slot] = cost
 
     def remove_edge(self, crd1, crd2):
         if self.has_edge(crd1, crd2):
-            del self.succ[crd1][crd2]
-            del self.pred[crd2][crd1]
+            slot = edge_slots[(crd2[0] - crd1[0], crd2[1] - crd1[1], crd2[2] - crd1[2])]
+            self.succ[self.index[crd1]] &= ~(1 << slot)
+            self.pred[self.index[crd2]] &= ~(1 << (EDGE_SLOTS - 1 - slot))
+            self.edges -= 1
+
+    def set_edges(self, crd, succ, pred, costs):
+        """
+        masks of a node at once, costs of the succ edges in slot order.
+        the nodes at the other ends have to get matching masks.
+        """
+        nid = self.index[crd]
+        self.edges += bin(succ).count("1") - bin(self.succ[nid]).count("1")
+        if self.shortened is not None:
+            self.shortened.add(crd)
+        self.succ[nid] = succ
+        self.pred[nid] = pred
+        base = nid * EDGE_SLOTS
+        k = 0
+        while succ:
+            bit = succ & -succ
+            succ ^= bit
+            self.costs[base + bit.bit_length() - 1] = costs[k]
+            k += 1
 
     def get_succ(self, crd):
-        return self.succ[crd].items()
+        nid = self.index[crd]
+        x, y, z = crd
+        mask = self.succ[nid]
+        base = nid * EDGE_SLOTS
+        out = []
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            slot = bit.bit_length() - 1
+            dx, dy, dz = edge_offsets[slot]
+            out.append(((x + dx, y + dy, z + dz), self.costs[base + slot]))
+        return out
+
+    def get_pred(self, crd):
+        x, y, z = crd
+        mask = self.pred[self.index[crd]]
+        out = []
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            slot = bit.bit_length() - 1
+            dx, dy, dz = edge_offsets[slot]
+            other = (x + dx, y + dy, z + dz)
+            out.append((other, self.costs[self.index[other] * EDGE_SLOTS + EDGE_SLOTS - 1 - slot]))
+        return out
+
+
+_empty_costs = array('f', [0.0]) * EDGE_SLOTS
+_coords_size = sys.getsizeof((0, 0, 0)) + 3 * sys.getsizeof(0)
 
 
 class LLNode(object):
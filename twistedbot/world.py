@@ -7,7 +7,9 @@ import tools
 import config
 from entities import Entities
 from grid import Grid
-from navigationgrid import NavigationGrid
+from navigationgrid import NavigationGrid, SeedPool
+from worldcache import WorldCache, cache_path
+from navsnapshot import save_snapshot, snapshot_path
 from statistics import Statistics
 from chat import Chat
 from botentity import BotEntity
@@ -39,19 +41,33 @@ class World(object):
         self.dim_grid = [None, None, None]
         self.dim_navgrid = [None, None, None]
         self.players = defaultdict(int)
+        self.seed_pool = SeedPool() if config.NAVGRID_WORKERS > 0 else None
         tools.do_later(config.TIME_STEP, self.tick)
 
     def tick(self):
         t = config.TIME_STEP
         if self.logged_in:
             t = self.bot.tick()
+            if self.bot.location_received:
+                self.navgrid.focus(bot=self.bot.bot_object.position_grid)
             self.every_n_ticks()
+        tools.work_scheduler.next_tick(t)
         tools.do_later(t, self.tick)
 
     def every_n_ticks(self, n=100):
         self.game_ticks += 1
         if self.game_ticks % n == 0:
             self.status_diff.log()
+            if tools.work_scheduler.slices:
+                log.msg(tools.work_scheduler)
+            if self.seed_pool is not None and self.seed_pool.sent:
+                log.msg(self.seed_pool)
+            if self.navgrid is not None and self.navgrid.incomplete_nodes.done:
+                log.msg("navgrid %s" % self.navgrid.incomplete_nodes)
+            if self.navgrid is not None and self.navgrid.route_cache.routes:
+                log.msg(self.navgrid.route_cache)
+            if self.bot.location_received:
+                self.grid.evict_chunks((self.bot.bot_object.grid_x >> 4, self.bot.bot_object.grid_z >> 4))
 
     def on_connection_lost(self):
         self.connected = False
@@ -63,7 +79,21 @@ class World(object):
         self.connected = True
 
     def on_shutdown(self):
-        pass
+        if self.seed_pool is not None:
+            self.seed_pool.close()
+        for dim in xrange(len(self.dim_grid)):
+            self.close_cache(dim)
+
+    def close_cache(self, dim):
+        """
+        snapshot the navgrid of the dimension next to its world cache
+        """
+        grid = self.dim_grid[dim]
+        if grid is None or grid.cache is None:
+            return
+        if self.dim_navgrid[dim] is not None:
+            save_snapshot(self.dim_navgrid[dim], grid, snapshot_path(grid.cache.path))
+        grid.cache.close()
 
     def send_packet(self, name, payload):
         if self.protocol is not None:
@@ -73,12 +103,22 @@ class World(object):
 
     def dimension_change(self, dimension):
         dim = dimension + 1  # to index from 0
+        for other in xrange(len(self.dim_grid)):
+            if other != dim and self.dim_grid[other] is not None:
+                # server sends the chunks again when coming back
+                log.msg("releasing dimension %d" % (other - 1))
+                self.close_cache(other)
+                self.dim_entities[other] = None
+                self.dim_grid[other] = None
+                self.dim_navgrid[other] = None
         if self.dim_entities[dim] is None:
             es = Entities(self)
             self.dim_entities[dim] = es
             self.entities = es
         if self.dim_grid[dim] is None:
             gd = Grid(self)
+            if config.WORLD_CACHE_DIR is not None:
+                gd.cache = WorldCache(cache_path(self.server_host, self.server_port, dimension))
             self.dim_grid[dim] = gd
             self.grid = gd
         if self.dim_navgrid[dim] is None:
@@ -0,0 +1,133 @@
+
+import os
+import re
+import mmap
+import struct
+
+import config
+import logbot
+from grid import expand_nibbles
+
+
+log = logbot.getlogger("WORLDCACHE")
+
+
+SECTION_HEADER = struct.Struct("<4siiI")
+SECTION_MAGIC = "TBS1"
+SECTION_FREE = 0xffffffff
+SECTION_SIZE = SECTION_HEADER.size + 4096 + 2048
+GROW_SECTIONS = 256
+
+
+def cache_path(host, port, dimension):
+    name = "%s_%d_%d.sections" % (re.sub(r"[^\w.-]", "_", str(host)), port, dimension)
+    return os.path.join(config.WORLD_CACHE_DIR, name)
+
+
+class WorldCache(object):
+    """
+    chunk sections of one server and dimension in a memory mapped file.
+    the file is a row of fixed size slots, each one a header with chunk
+    coords and level, 4096 block ids and 2048 bytes of meta nibbles as
+    the server sends them. the index is read back from the headers when
+    the file is opened, free slots have no magic or a free level.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.chunks = {}
+        self.free = []
+        self.served = 0
+        self.stored = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % SECTION_SIZE != 0:
+            log.msg("world cache %s has a different format, starting it again" % path)
+            self.file.truncate(0)
+            size = 0
+        if size == 0:
+            size = GROW_SECTIONS * SECTION_SIZE
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        for slot in xrange(size / SECTION_SIZE):
+            magic, x, z, level = SECTION_HEADER.unpack_from(self.map, slot * SECTION_SIZE)
+            if magic != SECTION_MAGIC or level == SECTION_FREE:
+                self.free.append(slot)
+            else:
+                self.chunks.setdefault((x, z), {})[level] = slot
+        self.free.reverse()
+        log.msg("world cache %s with %d chunks" % (path, len(self.chunks)))
+
+    def __str__(self):
+        return "world cache chunks %d served %d stored %d" % (len(self.chunks), self.served, self.stored)
+
+    def chunks_around(self, center, distance):
+        return [coords for coords in self.chunks
+                if max(abs(coords[0] - center[0]), abs(coords[1] - center[1])) <= distance]
+
+    def load(self, coords, chunk):
+        """
+        fill the levels of chunk from the cache
+        """
+        for level, slot in self.chunks[coords].iteritems():
+            offset = slot * SECTION_SIZE + SECTION_HEADER.size
+            chunk.blocks[level] = bytearray(self.map[offset:offset + 4096])
+            chunk.meta[level] = expand_nibbles(self.map[offset + 4096:offset + 6144])
+        self.served += 1
+
+    def store(self, coords, levels):
+        """
+        levels is {level: (block ids, meta nibbles)} of a whole chunk,
+        levels that are not there any more are freed
+        """
+        slots = self.chunks.setdefault(coords, {})
+        for level in [level for level in slots if level not in levels]:
+            self.free_slot(slots.pop(level))
+        for level, (ids, meta) in levels.iteritems():
+            slot = slots.get(level, None)
+            if slot is None:
+                slot = slots[level] = self.new_slot()
+            offset = slot * SECTION_SIZE
+            self.map[offset + SECTION_HEADER.size:offset + SECTION_SIZE] = ids + meta
+            self.map[offset:offset + SECTION_HEADER.size] = \
+                SECTION_HEADER.pack(SECTION_MAGIC, coords[0], coords[1], level)
+        if not slots:
+            del self.chunks[coords]
+        self.stored += 1
+
+    def block_change(self, x, y, z, block_id, meta):
+        """
+        write through a changed block, sections not in the cache wait for
+        the next time their chunk is stored
+        """
+        slot = self.chunks.get((x >> 4, z >> 4), {}).get(y >> 4, None)
+        if slot is None:
+            return
+        pos = ((y & 15) << 8) | ((z & 15) << 4) | (x & 15)
+        offset = slot * SECTION_SIZE + SECTION_HEADER.size
+        self.map[offset + pos] = chr(block_id)
+        nibbles = ord(self.map[offset + 4096 + (pos >> 1)])
+        if pos & 1:
+            nibbles = (nibbles & 0x0f) | (meta << 4)
+        else:
+            nibbles = (nibbles & 0xf0) | meta
+        self.map[offset + 4096 + (pos >> 1)] = chr(nibbles)
+
+    def new_slot(self):
+        if not self.free:
+            slots = len(self.map) / SECTION_SIZE
+            self.map.resize((slots + GROW_SECTIONS) * SECTION_SIZE)
+            self.free.extend(reversed(xrange(slots, slots + GROW_SECTIONS)))
+        return self.free.pop()
+
+    def free_slot(self, slot):
+        offset = slot * SECTION_SIZE
+        self.map[offset:offset + SECTION_HEADER.size] = SECTION_HEADER.pack(SECTION_MAGIC, 0, 0, SECTION_FREE)
+        self.free.append(slot)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()